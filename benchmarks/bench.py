@@ -0,0 +1,302 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Throughput benchmarks for loaders, CallCopy and Runner.
+
+Synthetic templates of several shapes are generated, both as directories
+and as zip files, and each measurement is run in its own process so its
+peak RSS can be reported. Usage::
+
+    python benchmarks/bench.py -o results.json
+    python benchmarks/bench.py -o new.json --compare results.json
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+import resource
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'inception'))
+
+SETTINGS = '''
+QUESTIONS = [
+    {"kind": "text", "name": "name", "message": "Name", "default": "bench"},
+]
+'''
+METADATA = '''
+name = "bench"
+version = "1.0.0"
+'''
+HEAVY_BODY = '''{% for i in range(200) %}
+{{ name }} line {{ i }} {% if i is divisibleby 3 %}fizz{% endif %}
+{% endfor %}
+'''
+
+
+def _write(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as fd:
+        fd.write(content)
+
+
+def many_small(files, scale):
+    for i in range(int(2000 * scale)):
+        _write(os.path.join(files, 'd%02d' % (i % 50), 'f%05d.txt' % i),
+               b'x' * 1024)
+
+
+def deep_tree(files, scale):
+    path = files
+    for depth in range(int(40 * scale) or 1):
+        path = os.path.join(path, 'level%d' % depth)
+        for i in range(5):
+            _write(os.path.join(path, 'f%d.txt' % i), b'deep\n' * 20)
+
+
+def large_binaries(files, scale):
+    chunk = os.urandom(1024 * 1024)
+    for i in range(3):
+        with open(os.path.join(files, 'blob%d.bin' % i), 'wb') as fd:
+            for _ in range(int(64 * scale) or 1):
+                fd.write(chunk)
+
+
+def heavy_jinja(files, scale):
+    for i in range(int(300 * scale) or 1):
+        _write(os.path.join(files, 'tpl%04d.txt.jinja' % i),
+               HEAVY_BODY.encode('utf-8'))
+
+
+def templated_names(files, scale):
+    for i in range(int(1000 * scale) or 1):
+        _write(os.path.join(files, '{{ name }}', '{{ name }}_%04d.txt' % i),
+               b'named\n')
+
+
+SHAPES = dict(
+    many_small=many_small,
+    deep_tree=deep_tree,
+    large_binaries=large_binaries,
+    heavy_jinja=heavy_jinja,
+    templated_names=templated_names,
+)
+
+
+def build_template(workdir, shape, scale):
+    """Builds the `shape` template in `workdir`. Returns the paths of the
+    directory and zip versions."""
+    path = os.path.join(workdir, shape)
+    files = os.path.join(path, 'files')
+    os.makedirs(files)
+    SHAPES[shape](files, scale)
+    _write(os.path.join(path, 'settings.py'), SETTINGS.encode('utf-8'))
+    _write(os.path.join(path, 'metadata.py'), METADATA.encode('utf-8'))
+
+    zpath = path + '.zip'
+    with zipfile.ZipFile(zpath, 'w', zipfile.ZIP_DEFLATED) as z:
+        for root, dirs, names in os.walk(path):
+            for name in dirs + names:
+                origin = os.path.join(root, name)
+                arcname = os.path.relpath(origin, path).replace(os.sep, '/')
+                if name.endswith('.bin'):
+                    z.write(origin, arcname, zipfile.ZIP_STORED)
+                else:
+                    z.write(origin, arcname)
+    return path, zpath
+
+
+def _walk(template, output):
+    # bodies are not read, so only files are counted: no MB/s for walk
+    import loader
+    files = 0
+    for path_content in loader.get_loader(template).walk('files'):
+        if path_content.is_file:
+            files += 1
+    return files, 0
+
+
+def _copy(template, output):
+    import loader
+    import commands
+    from variables import Variables
+    Variables().update(name='bench')
+    commands.CallCopy()(loader.get_loader(template), output)
+    return _count(output)
+
+
+def _run(template, output):
+    import loader
+    from runner import Runner
+    from variables import Options
+    Options()['interactive'] = False
+    Runner(loader.get_loader(template)).run(output)
+    return _count(output)
+
+
+def _count(output):
+    files = size = 0
+    for root, dirs, names in os.walk(output):
+        files += len(names)
+        size += sum(os.path.getsize(os.path.join(root, x)) for x in names)
+    return files, size
+
+
+BENCHMARKS = dict(
+    walk=_walk,
+    copy=_copy,
+    run=_run,
+)
+
+
+def _measure(queue, name, template, output):
+    # imports are not part of the measure
+    import loader  # noqa
+    import runner  # noqa
+    start = time.time()
+    try:
+        files, size = BENCHMARKS[name](template, output)
+    except Exception as e:
+        queue.put(dict(error='%s: %s' % (type(e).__name__, e)))
+        raise
+    elapsed = time.time() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    queue.put(dict(
+        seconds=elapsed,
+        files=files,
+        bytes=size,
+        files_per_sec=files / elapsed if elapsed else 0,
+        mb_per_sec=size / 1048576.0 / elapsed if elapsed and size else None,
+        peak_rss_kb=rss,
+    ))
+
+
+def measure(name, template, output):
+    """Runs the benchmark `name` in a new process, with a new HOME so every
+    run starts with empty caches."""
+    home = tempfile.mkdtemp(prefix='inception-home-')
+    os.environ['HOME'] = home
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure,
+                                      args=(queue, name, template, output))
+    process.start()
+    result = queue.get()
+    process.join()
+    shutil.rmtree(output, ignore_errors=True)
+    shutil.rmtree(home, ignore_errors=True)
+    return result
+
+
+def run_all(shapes, scale, repeat):
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='inception-bench-')
+    try:
+        for shape in shapes:
+            path, zpath = build_template(workdir, shape, scale)
+            for form, template in (('dir', path), ('zip', zpath)):
+                for name in sorted(BENCHMARKS):
+                    key = '%s/%s/%s' % (shape, form, name)
+                    output = os.path.join(workdir, 'output')
+                    runs = [measure(name, template, output)
+                            for _ in range(repeat)]
+                    if 'error' in runs[0]:
+                        print('%-36s failed: %s' % (key, runs[0]['error']))
+                        continue
+                    best = min(runs, key=lambda x: x['seconds'])
+                    results[key] = best
+                    mb_per_sec = best['mb_per_sec']
+                    print('%-36s %8.3fs %10.0f files/s %8s MB/s %8d KB'
+                          % (key, best['seconds'], best['files_per_sec'],
+                             '-' if mb_per_sec is None
+                             else '%.1f' % mb_per_sec,
+                             best['peak_rss_kb']))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Returns the list of regressions of `results` against `baseline`."""
+    regressions = []
+    for key, current in sorted(results.items()):
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        for metric in ('files_per_sec', 'mb_per_sec'):
+            # metrics not measured by a benchmark are None
+            if previous.get(metric) and current.get(metric) is not None and \
+                    current[metric] < previous[metric] * (1 - threshold):
+                regressions.append((key, metric, previous[metric],
+                                    current[metric]))
+        if current['peak_rss_kb'] > previous['peak_rss_kb'] * (1 + threshold):
+            regressions.append((key, 'peak_rss_kb', previous['peak_rss_kb'],
+                                current['peak_rss_kb']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', help='JSON file for the results.')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='JSON file with previous results to compare to.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed relative change before a regression '
+                        'is reported.')
+    parser.add_argument('--shape', action='append', choices=sorted(SHAPES),
+                        help='Shapes to be run. All of them by default.')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Factor applied to the size of every shape.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per benchmark; the best one is kept.')
+    args = parser.parse_args()
+
+    results = run_all(args.shape or sorted(SHAPES), args.scale, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)
+        regressions = compare(results, baseline, args.threshold)
+        for key, metric, previous, current in regressions:
+            print('REGRESSION %s %s: %.1f -> %.1f'
+                  % (key, metric, previous, current))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""Startup benchmark: time to import the command line, from -X importtime.
+
+The command line must start within BUDGET milliseconds and import none of
+the LAZY modules, which are loaded only by the actions using them. Usage::
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --budget 100 --top 20
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = os.path.join(ROOT, 'inception')
+
+BUDGET = 150
+LAZY = ('jinja2', 'inquirer', 'downloader', 'sqlite3', 'httplib',
+        'http.client', 'multiprocessing', 'batch', 'compiled', 'server')
+
+
+def import_times(code='import main', home=None):
+    """Imported modules of a new interpreter running `code`, as a dict
+    from module name to (self, cumulative) microseconds."""
+    env = dict(os.environ, HOME=home or tempfile.gettempdir())
+    env.pop('PYTHONPROFILEIMPORTTIME', None)
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', code], cwd=SOURCE,
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = process.communicate()
+    if process.returncode:
+        raise RuntimeError(err.decode('utf-8', 'replace'))
+    times = {}
+    for line in err.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def measure(code='import main', repeat=5):
+    """Best of `repeat` runs: (milliseconds, import times of that run)."""
+    best = None
+    for _ in range(repeat):
+        times = import_times(code)
+        total = sum(own for own, _ in times.values()) / 1000.0
+        if best is None or total < best[0]:
+            best = (total, times)
+    return best
+
+
+def eager(times, modules=LAZY):
+    """Lazy `modules` found in the import `times`."""
+    return sorted(x for x in times
+                  if x in modules or x.split('.')[0] in modules)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget', type=float, default=BUDGET,
+                        help='Maximum milliseconds to import the command '
+                        'line.')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of slowest imports shown.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs measured; the best one is kept.')
+    args = parser.parse_args()
+
+    total, times = measure(repeat=args.repeat)
+    slowest = sorted(times.items(), key=lambda x: -x[1][1])[:args.top]
+    for name, (own, cumulative) in slowest:
+        print('%8.1fms %8.1fms  %s' % (cumulative / 1000.0, own / 1000.0,
+                                       name))
+    print('startup: %.1fms (budget %.1fms)' % (total, args.budget))
+    failed = False
+    for name in eager(times):
+        print('EAGER IMPORT %s' % name)
+        failed = True
+    if total > args.budget:
+        print('OVER BUDGET')
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
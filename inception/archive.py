@@ -0,0 +1,138 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import io
+import sys
+import time
+import stat
+import logging
+import tarfile
+import zipfile
+
+import fileutils
+
+LOGGER = logging.getLogger('inception.' + __name__)
+
+TAR_MODES = (
+    ('.tar.gz', 'w:gz'),
+    ('.tgz', 'w:gz'),
+    ('.tar.bz2', 'w:bz2'),
+    ('.tar.xz', 'w:xz'),
+    ('.tar', 'w'),
+)
+
+
+def is_archive(output):
+    """Whether `output` names an archive (or '-', a tar stream to the
+    standard output) instead of a directory."""
+    if output is None:
+        return False
+    return output == '-' or output.endswith('.zip') or any(
+        output.endswith(extension) for extension, _ in TAR_MODES)
+
+
+class ArchiveWriter(object):
+    """Writes entries straight into a tar or zip archive.
+
+    With `path` '-' a tar stream is written into `fileobj`, or into the
+    standard output if not given. Permissions are stored as given, or as
+    644 for files and 755 for directories when unknown.
+    """
+    FILE_PERMISSION = stat.S_IFREG | 0o644
+    DIR_PERMISSION = stat.S_IFDIR | 0o755
+
+    def __init__(self, path, fileobj=None):
+        self.path = path
+        self._names = set()
+        self._mtime = time.time()
+        self._tar = None
+        self._zip = None
+        if path == '-':
+            stream = fileobj or getattr(sys.stdout, 'buffer', sys.stdout)
+            self._tar = tarfile.open(fileobj=stream, mode='w|')
+        elif path.endswith('.zip'):
+            self._zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            mode = next(m for e, m in TAR_MODES if path.endswith(e))
+            self._tar = tarfile.open(path, mode)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_dir(self, name, permission=None):
+        name = name.rstrip('/')
+        if not name or name in self._names:
+            return
+        self._names.add(name)
+        permission = permission or self.DIR_PERMISSION
+        if self._zip is not None:
+            info = self._zip_info(name + '/', permission)
+            info.external_attr |= 0x10  # MS-DOS directory flag
+            self._zip.writestr(info, b'')
+        else:
+            info = self._tar_info(name, permission)
+            info.type = tarfile.DIRTYPE
+            self._tar.addfile(info)
+
+    def add_file(self, name, fileobj, size, permission=None):
+        """Adds `size` bytes read from `fileobj`."""
+        self._names.add(name)
+        permission = permission or self.FILE_PERMISSION
+        if self._zip is not None:
+            info = self._zip_info(name, permission)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            if sys.version_info >= (3, 6):
+                with self._zip.open(info, 'w') as target:
+                    fileutils.copy_fileobj(fileobj, target, size)
+            else:
+                self._zip.writestr(info, fileobj.read(size))
+        else:
+            info = self._tar_info(name, permission)
+            info.size = size
+            self._tar.addfile(info, fileobj)
+
+    def add_bytes(self, name, content, permission=None):
+        self.add_file(name, io.BytesIO(content), len(content), permission)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+    def _tar_info(self, name, permission):
+        info = tarfile.TarInfo(name)
+        info.mode = stat.S_IMODE(permission)
+        info.mtime = self._mtime
+        return info
+
+    def _zip_info(self, name, permission):
+        info = zipfile.ZipInfo(name, time.localtime(self._mtime)[:6])
+        info.external_attr = permission << 16
+        return info
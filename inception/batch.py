@@ -0,0 +1,134 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import json
+import time
+import logging
+import multiprocessing
+
+from loader import get_loader, load_template
+from runner import Runner
+from variables import Options, RenderContext
+
+LOGGER = logging.getLogger('inception.' + __name__)
+
+_LOADER = None
+
+
+class BatchResult(object):
+    def __init__(self, line, output, error=None, elapsed=0):
+        self.line = line
+        self.output = output
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def read_records(path):
+    """Yields (line number, line) for each record of a JSON lines file.
+
+    Each record is a dict like ``{"output": "path", "answers": {...}}``.
+    Lines are parsed when the record is applied, so a malformed one only
+    fails its own record.
+    """
+    with open(path) as fd:
+        for number, line in enumerate(fd, 1):
+            line = line.strip()
+            if line:
+                yield number, line
+
+
+def apply_batch(template, answers, base=None, parallel=1):
+    """Applies `template` once for each record in the `answers` file.
+
+    The template is loaded just once (once per worker when `parallel` is
+    greater than 1) and questions are answered from the record instead of
+    prompting. Relative outputs are taken from `base`.
+    """
+    Options()['interactive'] = False
+    # stored templates are resolved once, and workers load their path
+    template = load_template(template).path
+    records = ((number, line, base)
+               for number, line in read_records(answers))
+    if parallel > 1:
+        pool = multiprocessing.Pool(parallel, _init_worker,
+                                    (template, dict(Options())))
+        try:
+            results = [_report(x) for x in pool.imap(_apply_record, records)]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(template, dict(Options()))
+        results = [_report(_apply_record(x)) for x in records]
+
+    failed = len([x for x in results if not x.ok])
+    LOGGER.info('Batch finished: %d created, %d failed',
+                len(results) - failed, failed)
+    return results
+
+
+def _init_worker(template, options):
+    global _LOADER
+    Options().update(options)
+    _LOADER = get_loader(template)
+    _LOADER.settings
+
+
+def _apply_record(args):
+    number, line, base = args
+    start = time.time()
+    try:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError('Record is not a JSON object')
+    except ValueError as e:
+        return BatchResult(number, None, '%s: %s' % (type(e).__name__, e))
+    output = record.get('output')
+    if base and output:
+        output = os.path.join(base, output)
+    try:
+        if not output:
+            raise ValueError('No output given')
+        if not os.path.exists(output):
+            os.makedirs(output)
+        context = RenderContext(record.get('answers'), Options())
+        Runner(_LOADER).run(output, context)
+    except Exception as e:
+        return BatchResult(number, output, '%s: %s' % (type(e).__name__, e),
+                           time.time() - start)
+    return BatchResult(number, output, elapsed=time.time() - start)
+
+
+def _report(result):
+    if result.ok:
+        LOGGER.info('[line %d] %s created in %.2fs', result.line,
+                    result.output, result.elapsed)
+    else:
+        LOGGER.error('[line %d] %s failed: %s', result.line, result.output,
+                     result.error)
+    return result
@@ -21,86 +21,660 @@
 # THE SOFTWARE.
 
 import os
-import subprocess
+import sys
+import json
+import signal
+import functools
 import logging
-import jinja2
-import inquirer
+import hashlib
+import threading
+import collections
 
-from variables import Variables
+from variables import current_context
+from manifest import Manifest, inputs_hash
+from runcache import RUN_CACHE
+from profiler import PROFILER, span
+import fileutils
 
 
 LOGGER = logging.getLogger('inception.' + __name__)
+CACHE_PATH = os.path.join(os.environ['HOME'], '.inception', 'cache')
 
 
-class CallRun(object):
-    def __init__(self, command):
+class TemplateCache(object):
+    """Compiled jinja templates, keyed by the hash of their source.
+
+    Recently used templates are kept in memory (up to `size` of them) and
+    every compiled template is also stored as bytecode in `directory`, so
+    applying the same template again does not compile anything. jinja is
+    imported the first time a template is needed.
+    """
+    DIRECTORY = os.path.join(CACHE_PATH, 'jinja')
+
+    def __init__(self, size=512, directory=DIRECTORY):
+        self._size = size
+        self._directory = directory
+        self._templates = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._environment = None
+
+    @property
+    def environment(self):
+        with self._lock:
+            if self._environment is None:
+                import jinja2
+                self._environment = jinja2.Environment(
+                    bytecode_cache=self._bytecode_cache(self._directory))
+        return self._environment
+
+    def get(self, source, code=None):
+        """Template of `source`. When its compiled `code` is given, it is
+        used instead of compiling it."""
+        key = self.key(source)
+        with self._lock:
+            template = self._templates.pop(key, None)
+        if template is None and code is not None:
+            template = self._from_code(code)
+        if template is None:
+            template = self._compile(key, source)
+        with self._lock:
+            self._templates[key] = template
+            while len(self._templates) > self._size:
+                self._templates.popitem(last=False)
+        return template
+
+    def variables(self, source):
+        """Sorted names of the variables used by `source`, found without
+        rendering it."""
+        from jinja2 import meta
+        return sorted(meta.find_undeclared_variables(
+            self.environment.parse(source)))
+
+    def key(self, source):
+        if not isinstance(source, bytes):
+            source = source.encode('utf-8')
+        return hashlib.sha1(source).hexdigest()
+
+    def _compile(self, key, source):
+        env = self.environment
+        bcc = env.bytecode_cache
+        bucket = None
+        if bcc is not None:
+            bucket = bcc.get_bucket(env, key, None, source)
+        if bucket is not None and bucket.code is not None:
+            code = bucket.code
+        else:
+            LOGGER.debug('compiling template %s', key)
+            code = env.compile(source, key)
+            if bucket is not None:
+                bucket.code = code
+                bcc.set_bucket(bucket)
+        return self._from_code(code)
+
+    def _from_code(self, code):
+        env = self.environment
+        return env.template_class.from_code(env, code, env.make_globals(None))
+
+    def _bytecode_cache(self, directory):
+        if directory is None:
+            return None
+        try:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+        except OSError as e:
+            LOGGER.warning('Template cache disabled: %s', e)
+            return None
+        import jinja2
+        return jinja2.FileSystemBytecodeCache(directory)
+
+
+TEMPLATES = TemplateCache()
+
+
+class Promise(object):
+    """Base of the builtin promises.
+
+    `name` identifies the promise, and many promises can share it to form a
+    stage. `after` is the name, or list of names, of the promises it waits
+    for when the program is run concurrently. When it is not given, the
+    promise waits for the previous one in the program.
+    """
+    def __init__(self, name=None, after=None):
+        self.name = name
+        if after is not None and not isinstance(after, (list, tuple, set)):
+            after = (after,)
+        self.after = None if after is None else tuple(after)
+
+    def plan(self, loader, output, plan, context=None):
+        """Adds what the promise would do to `plan`, without doing it."""
+        plan.command(repr(self))
+
+
+class CallRun(Promise):
+    """Runs a shell command in the output directory.
+
+    With `cache`, the `outputs` it produces (files or directories relative
+    to the output) are stored after running it, and restored instead of
+    running it again when the command, the template version, the
+    `variables` (all of them if not given) and the content of the `inputs`
+    files are the same.
+    """
+    def __init__(self, command, cache=False, outputs=(), inputs=(),
+                 variables=None, name=None, after=None):
+        super(CallRun, self).__init__(name, after)
+        if cache and not outputs:
+            raise ValueError('Cached run(%r) requires outputs' % command)
         self._command = command
+        self._cache = cache
+        self._outputs = outputs
+        self._inputs = inputs
+        self._variables = variables
 
-    def __call__(self, loader, output):
+    def __repr__(self):
+        return 'run(%r)' % self._command
+
+    def __call__(self, loader, output, context=None):
+        self._cached(loader, output, context, self._call, output)
+
+    def stream(self, loader, output, write, cancelled, context=None):
+        """Runs the command, giving each line of its output to `write`, and
+        terminates it as soon as the `cancelled` event is set."""
+        self._cached(loader, output, context, self._stream, output, write,
+                     cancelled)
+
+    def _cached(self, loader, output, context, execute, *args):
+        if not self._cache:
+            return execute(*args)
+        context = context or current_context()
+        key = RUN_CACHE.key(self._command, self._cache_variables(context),
+                            self._inputs, output,
+                            [loader.name, loader.version_str])
+        with PROFILER.span(repr(self), 'cache') as cache_span:
+            hit = RUN_CACHE.restore(key, output)
+            cache_span.set(hit=hit)
+        if hit:
+            LOGGER.info('Restored the outputs of %r from cache', self)
+            return
+        execute(*args)
+        RUN_CACHE.store(key, output, self._outputs)
+
+    def _cache_variables(self, context):
+        variables = dict(context.variables)
+        if self._variables is None:
+            return variables
+        return dict((k, variables.get(k)) for k in self._variables)
+
+    def _call(self, output):
+        import subprocess
         LOGGER.debug('running CallRun("%s")', self._command)
-        return subprocess.check_call(self._command, shell=True, cwd=output)
+        subprocess.check_call(self._command, shell=True, cwd=output)
+
+    def _stream(self, output, write, cancelled):
+        import subprocess
+        LOGGER.debug('streaming CallRun("%s")', self._command)
+        # in its own process group, to terminate the children of the shell
+        process = subprocess.Popen(self._command, shell=True, cwd=output,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   preexec_fn=getattr(os, 'setsid', None))
+        finished = threading.Event()
+        watcher = threading.Thread(target=self._watch,
+                                   args=(process, finished, cancelled))
+        watcher.daemon = True
+        watcher.start()
+        try:
+            for line in iter(process.stdout.readline, b''):
+                write(line.decode('utf-8', 'replace').rstrip('\r\n'))
+            returncode = process.wait()
+        finally:
+            finished.set()
+            process.stdout.close()
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, self._command)
+
+    def _watch(self, process, finished, cancelled):
+        while not finished.is_set():
+            if cancelled.wait(0.1):
+                LOGGER.debug('terminating CallRun("%s")', self._command)
+                try:
+                    if hasattr(os, 'killpg'):
+                        os.killpg(process.pid, signal.SIGTERM)
+                    else:
+                        process.terminate()
+                except OSError:
+                    pass
+                return
+
 
+class CallCopy(Promise):
+    """Copies the `source` directory of the template into the output.
 
-class CallCopy(object):
-    def __init__(self, source='files'):
+    With `jobs` greater than 1, directories are created first and then files
+    are rendered and written by a pool of `jobs` workers: threads by default,
+    or processes when `pool` is 'process', which pays off when the jinja
+    bodies are CPU heavy. If not given, `jobs` is taken from the command
+    line.
+
+    Generated files are recorded in the output manifest. When updating,
+    existing files are rewritten if their inputs changed and they were not
+    modified since they were generated.
+    """
+    def __init__(self, source='files', jobs=None, pool='thread', name=None,
+                 after=None):
+        super(CallCopy, self).__init__(name, after)
         self._source = source
+        self._jobs = jobs
+        self._pool = pool
 
-    def __call__(self, loader, output):
-        for path_content in loader.walk(self._source):
-            path = os.path.join(output,
-                                self._parse(path_content.relative_path))
+    def __repr__(self):
+        return 'copy(%r)' % self._source
+
+    @property
+    def source(self):
+        return self._source
+
+    def __call__(self, loader, output, context=None):
+        context = context or current_context()
+        jobs = self._jobs or context.options.get('jobs') or 1
+        update = context.options.get('update', False)
+        if not os.path.exists(output):
+            os.makedirs(output)
+        manifest = Manifest(output)
+        manifest.template = loader.path
+        manifest.variables = dict(context.variables)
+        pending = []
+        targets = set()
+        for path_content in self._walk(loader):
             if path_content.is_dir:
+                path = self._target(output, path_content, context)
                 if not os.path.exists(path):
                     LOGGER.info('Creating directory %s', path)
                     os.makedirs(path)
                 continue
             if path_content.is_file:
-                if path_content.relative_path.endswith('.jinja'):
-                    relative = path_content.relative_path[:-len('.jinja')]
-                    content = self._parse(path_content.content)
-                else:
-                    relative = path_content.relative_path
-                    content = path_content.content
-                target = os.path.join(output, self._parse(relative))
-                if os.path.exists(target):
-                    LOGGER.warning(
-                        'File "%s" already exists and will not be overriden.',
-                        target)
+                is_template = path_content.relative_path.endswith('.jinja')
+                target = self._target(output, path_content, context)
+                task = (target, path_content, is_template)
+                if target in targets:
+                    LOGGER.warning('File "%s" is written by another file '
+                                   'and will not be overriden.', target)
                     continue
-                self._write_result(target, content, path_content.permission)
+                if os.path.exists(target):
+                    if not update:
+                        LOGGER.warning('File "%s" already exists and will '
+                                       'not be overriden.', target)
+                        continue
+                    if not self._outdated(manifest, output, task, context):
+                        continue
+                targets.add(target)
+                if jobs > 1:
+                    pending.append(task)
+                else:
+                    self._record(manifest, output, task,
+                                 self._materialize(task, context), context)
+        if pending:
+            results = self._materialize_all(pending, jobs, context)
+            for index, task in enumerate(pending):
+                self._record(manifest, output, task, results[index],
+                             context)
+        manifest.save()
+        loader.template_index.save()
+
+    def refresh(self, loader, output, paths, context=None):
+        """Writes again the files generated from `paths`, relative to the
+        source directory, as an update would, without walking the rest of
+        the template. Used when they are edited.
 
-    def _parse(self, template):
-        return jinja2.Template(template).render(Variables())
+        A path that cannot be written, like a template with a syntax error,
+        is logged and does not stop the others. Returns those paths.
+        """
+        context = context or current_context()
+        manifest = Manifest(output)
+        failed = []
+        for path in paths:
+            try:
+                self._refresh_path(loader, output, path, manifest, context)
+            except Exception as e:
+                LOGGER.error('Cannot write %s: %s', path, e)
+                LOGGER.debug('Error writing %s', path, exc_info=True)
+                failed.append(path)
+        manifest.save()
+        loader.template_index.save()
+        return failed
+
+    def _refresh_path(self, loader, output, path, manifest, context):
+        path_content = loader.get(self._source, path)
+        if path_content is None:
+            LOGGER.info('File %s was removed from the template', path)
+            return
+        target = self._target(output, path_content, context)
+        if path_content.is_dir:
+            if not os.path.exists(target):
+                LOGGER.info('Creating directory %s', target)
+                os.makedirs(target)
+            return
+        is_template = path.endswith('.jinja')
+        task = (target, path_content, is_template)
+        if (os.path.exists(target)
+                and not self._outdated(manifest, output, task, context)):
+            return
+        if not os.path.exists(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        self._record(manifest, output, task,
+                     self._materialize(task, context), context)
+
+    def plan(self, loader, output, plan, context=None):
+        """Adds the files it would write to `plan`, using only the names
+        and sizes of the template files. With the update option, generated
+        files are also hashed, as an update would, to tell those it would
+        write again."""
+        context = context or current_context()
+        update = context.options.get('update', False)
+        manifest = Manifest(output)
+        for path_content in loader.walk(self._source):
+            target = self._target(output, path_content, context)
+            relative = self._relative(output, target)
+            if path_content.is_dir:
+                if os.path.isdir(target):
+                    plan.add(relative, 'skip', path_content.relative_path)
+                elif os.path.lexists(target):
+                    plan.add(relative, 'conflict', path_content.relative_path,
+                             reason='not a directory')
+                else:
+                    plan.add(relative, 'create', path_content.relative_path)
+                continue
+            kwargs = dict(size=path_content.size,
+                          template=path_content.relative_path.endswith(
+                              '.jinja'))
+            if relative in plan:
+                plan.add(relative, 'conflict', path_content.relative_path,
+                         reason='written by another file', **kwargs)
+            elif not os.path.lexists(target):
+                plan.add(relative, 'create', path_content.relative_path,
+                         **kwargs)
+            elif manifest.get(relative) is None:
+                plan.add(relative, 'conflict', path_content.relative_path,
+                         reason='exists', **kwargs)
+            elif not update:
+                plan.add(relative, 'skip', path_content.relative_path,
+                         reason='generated', **kwargs)
+            else:
+                task = (target, path_content, kwargs['template'])
+                state = self._state(manifest, output, task, context)
+                if state == 'outdated':
+                    plan.add(relative, 'update', path_content.relative_path,
+                             **kwargs)
+                else:
+                    reason = 'modified' if state == 'modified' else \
+                        'up to date'
+                    plan.add(relative, 'skip', path_content.relative_path,
+                             reason=reason, **kwargs)
+
+    def archive(self, loader, writer, context=None):
+        """Writes the files into the `writer` archive instead of the output
+        directory, without touching the filesystem."""
+        context = context or current_context()
+        for path_content in self._walk(loader):
+            name = self._target('', path_content, context).replace(os.sep,
+                                                                   '/')
+            if path_content.is_dir:
+                writer.add_dir(name, path_content.permission)
+                continue
+            if not path_content.is_file:
+                continue
+            if name in writer:
+                LOGGER.warning('File "%s" is already in the archive.', name)
+                continue
+            is_template = path_content.relative_path.endswith('.jinja')
+            if is_template and path_content.is_binary:
+                LOGGER.warning('File "%s" is binary and will not be '
+                               'rendered.', path_content.relative_path)
+                is_template = False
+            with PROFILER.span(name, 'write'):
+                if is_template:
+                    content = self._parse(path_content.text, context,
+                                          path_content.template_code)
+                    writer.add_bytes(name, content.encode('utf-8'),
+                                     path_content.permission)
+                else:
+                    with path_content.open() as fd:
+                        writer.add_file(name, fd, path_content.size,
+                                        path_content.permission)
+        loader.template_index.save()
+
+    def _target(self, output, path_content, context):
+        """Output path of a template file. Only names with jinja markup are
+        rendered."""
+        relative = path_content.relative_path
+        if path_content.is_file and relative.endswith('.jinja'):
+            relative = relative[:-len('.jinja')]
+        if path_content.templated_name:
+            relative = self._parse(relative, context)
+        return os.path.join(output, relative)
+
+    def _walk(self, loader):
+        """loader.walk, measuring the time to get each entry."""
+        entries = iter(loader.walk(self._source))
+        while True:
+            with PROFILER.span('walk', 'walk') as walk_span:
+                try:
+                    path_content = next(entries)
+                except StopIteration:
+                    return
+                walk_span.set(path=path_content.relative_path)
+            yield path_content
+
+    def _outdated(self, manifest, output, task, context):
+        """Whether an existing target must be generated again. Warns when
+        it will not."""
+        target = task[0]
+        state = self._state(manifest, output, task, context)
+        if state == 'foreign':
+            LOGGER.warning(
+                'File "%s" already exists and will not be overriden.',
+                target)
+        elif state == 'modified':
+            LOGGER.warning(
+                'File "%s" was modified and will not be updated.', target)
+        elif state == 'current':
+            LOGGER.debug('File %s is up to date', target)
+        else:
+            LOGGER.info('Updating file %s', target)
+            return True
+        return False
+
+    def _state(self, manifest, output, task, context):
+        """State of an existing target: 'foreign' when it was not
+        generated, 'modified' when it changed after being generated,
+        'current' when its inputs did not change, or else 'outdated'."""
+        target, path_content, is_template = task
+        entry = manifest.get(self._relative(output, target))
+        if entry is None:
+            return 'foreign'
+        if fileutils.hash_file(target) != entry['hash']:
+            return 'modified'
+        if entry['inputs'] == self._inputs(path_content.hash, path_content,
+                                           is_template, context):
+            return 'current'
+        return 'outdated'
+
+    def _record(self, manifest, output, task, result, context):
+        target, path_content, is_template = task
+        source_hash, output_hash = result
+        manifest.add(self._relative(output, target),
+                     path_content.relative_path,
+                     self._inputs(source_hash, path_content, is_template,
+                                  context),
+                     output_hash)
+
+    def _relative(self, output, target):
+        return os.path.relpath(target, output).replace(os.sep, '/')
+
+    def _inputs(self, source_hash, path_content, is_template, context):
+        """Hash of the source and, for templates, of the variables they use,
+        so changing other answers does not make them outdated."""
+        if not is_template:
+            return inputs_hash(source_hash)
+        names = path_content.body_variables
+        if names is None:
+            return inputs_hash(source_hash, dict(context.variables))
+        return inputs_hash(source_hash, dict(
+            (x, context.variables.get(x)) for x in names))
+
+    def _materialize(self, task, context):
+        """Writes a file. Returns the hashes of its source and output."""
+        target, path_content, is_template = task
+        if is_template and path_content.is_binary:
+            LOGGER.warning('File "%s" is binary and will not be rendered.',
+                           path_content.relative_path)
+            is_template = False
+        if is_template:
+            with PROFILER.span(target, 'render'):
+                source = path_content.content
+                template = TEMPLATES.get(source.decode('utf-8'),
+                                         path_content.template_code)
+                LOGGER.debug('rendering file %s', target)
+                digest = fileutils.write_chunks(
+                    target, template.generate(context.variables),
+                    path_content.permission)
+            return fileutils.hash_text(source), digest
+        with PROFILER.span(target, 'write'):
+            self._copy_result(target, path_content)
+            digest = path_content.hash
+        return digest, digest
+
+    def _materialize_all(self, tasks, jobs, context):
+        LOGGER.debug('materializing %d files with %d %s workers',
+                     len(tasks), jobs, self._pool)
+        from multiprocessing.pool import ThreadPool
+        materialize = functools.partial(self._materialize, context=context)
+        threads = ThreadPool(jobs)
+        try:
+            if self._pool != 'process':
+                return threads.map(materialize, tasks)
+            results = [None] * len(tasks)
+            templates = [i for i, x in enumerate(tasks)
+                         if x[2] and not x[1].is_binary]
+            copies = [i for i in range(len(tasks)) if i not in templates]
+            copied = threads.map_async(materialize,
+                                       [tasks[i] for i in copies])
+            import multiprocessing
+            processes = multiprocessing.Pool(jobs)
+            try:
+                variables = dict(context.variables)
+                args = ((tasks[i][1].text, variables) for i in templates)
+                rendered = processes.imap(_render, args)
+                for index, (source_hash, content) in enumerate(rendered):
+                    target, path_content, _ = tasks[templates[index]]
+                    with PROFILER.span(target, 'write'):
+                        self._write_result(target, content,
+                                           path_content.permission)
+                    results[templates[index]] = (
+                        source_hash, fileutils.hash_text(content))
+            finally:
+                processes.close()
+                processes.join()
+            for index, result in enumerate(copied.get()):
+                results[copies[index]] = result
+            return results
+        finally:
+            threads.close()
+            threads.join()
+
+    def _parse(self, template, context, code=None):
+        return TEMPLATES.get(template, code).render(context.variables)
 
     def _write_result(self, target, content, perms):
         LOGGER.debug('writting file %s', target)
-        with open(target, 'w+') as fd:
-            fd.write(content)
-        if perms is not None:
-            os.chmod(target,  perms)
+        fileutils.write_chunks(target, [content], perms)
+
+    def _copy_result(self, target, path_content):
+        LOGGER.debug('copying file %s', target)
+        tmp = fileutils.temporary_path(target)
+        try:
+            path_content.copy_to(tmp)
+            if path_content.permission is not None:
+                os.chmod(tmp, path_content.permission)
+            os.rename(tmp, target)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
 
 
-class CallPrompt(object):
-    def __init__(self, questions=None):
+def _render(args):
+    source, variables = args
+    return (fileutils.hash_text(source),
+            TEMPLATES.get(source).render(variables))
+
+
+class CallPrompt(Promise):
+    def __init__(self, questions=None, name=None, after=None):
+        super(CallPrompt, self).__init__(name, after)
         self._questions = questions
 
-    def __call__(self, loader, output):
+    def __repr__(self):
+        return 'prompt()'
+
+    def plan(self, loader, output, plan, context=None):
+        # answers are needed to know the names of the files, and the plan
+        # is printed to stdout
+        self._ask(loader, context, sys.stderr)
+
+    def archive(self, loader, writer, context=None):
+        # the archive may be streamed to stdout
+        self._ask(loader, context, sys.stderr)
+
+    def __call__(self, loader, output, context=None):
+        self._ask(loader, context)
+
+    def _ask(self, loader, context, stream=None):
+        """Answers the questions, prompting them in `stream` (the standard
+        output if not given) when interactive."""
+        context = context or current_context()
         questions = self._questions or loader.settings.get('QUESTIONS')
         if questions is None:
             LOGGER.debug('No questions to prompt')
             return
 
         if isinstance(questions, str):
-            q = inquirer.load_from_json(questions)
-        if isinstance(questions, list):
-            q = inquirer.questions.load_from_list(questions)
-        Variables().update(inquirer.prompt(q))
+            questions = json.loads(questions)
+        if isinstance(questions, dict):
+            questions = [questions]
+        if context.options.get('interactive', True):
+            # inquirer takes a while to import, so only when prompting
+            import inquirer
+            # inquirer prints to sys.stdout
+            stdout = sys.stdout
+            sys.stdout = stream or stdout
+            try:
+                answers = inquirer.prompt(
+                    inquirer.questions.load_from_list(questions))
+            finally:
+                sys.stdout = stdout
+            context.variables.update(answers)
+        else:
+            context.variables.update(self._defaults(questions, context))
+
+    def _defaults(self, questions, context):
+        """Answers for non interactive runs: those already given or the
+        default of each question."""
+        answers = dict(context.variables)
+        for question in questions:
+            name = question['name']
+            if name in answers:
+                continue
+            if question.get('default') is None:
+                raise ValueError('No answer for question "%s"' % name)
+            answers[name] = question['default']
+        return answers
 
 
 COMMANDS = dict(
     run=CallRun,
     copy=CallCopy,
     prompt=CallPrompt,
+    span=span,
 )
 
 DEFAULT_PROGRAM = (CallPrompt(), CallCopy())
@@ -0,0 +1,93 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import io
+import os
+import sys
+import json
+import marshal
+import logging
+
+from loader import CompiledLoader, compile_python, jinja_version
+from commands import TEMPLATES
+import fileutils
+
+LOGGER = logging.getLogger('inception.' + __name__)
+
+
+def compile_package(loader, target):
+    """Writes the template of `loader` as a compiled package in `target`
+    (see `CompiledLoader`)."""
+    environment = TEMPLATES.environment
+    files = []
+    code = {}
+    tmp = '%s.%d.tmp' % (target, os.getpid())
+    with io.open(tmp + '.data', 'wb+') as data:
+        def append(content):
+            offset = data.tell()
+            data.write(content)
+            return [offset, len(content)]
+
+        for path_content in loader.walk(''):
+            path = path_content.relative_path.replace(os.sep, '/')
+            entry = dict(path=path, dir=path_content.is_dir,
+                         permission=path_content.permission,
+                         templated_name=path_content.templated_name)
+            files.append(entry)
+            if path_content.is_dir:
+                continue
+            body = path_content.content
+            entry.update(size=len(body), hash=fileutils.hash_text(body),
+                         body=append(body), binary=path_content.is_binary,
+                         templated_body=path.endswith('.jinja'))
+            if entry['templated_body'] and not entry['binary']:
+                entry['body_variables'] = path_content.body_variables
+                module = environment.compile(
+                    body.decode('utf-8'), TEMPLATES.key(body), raw=True)
+                entry['module'] = append(module.encode('utf-8'))
+                entry['code'] = append(marshal.dumps(
+                    compile(module, '<template %s>' % path, 'exec')))
+            elif path == 'settings.py':
+                code[path] = dict(code=append(marshal.dumps(
+                    compile_python(body, path))))
+        header = dict(
+            format=1,
+            python=sys.version,
+            jinja=jinja_version(),
+            metadata=loader.metadata,
+            files=files,
+            code=code,
+        )
+        header = json.dumps(header, sort_keys=True,
+                            default=str).encode('utf-8')
+        with io.open(tmp, 'wb') as fd:
+            fd.write(CompiledLoader.MAGIC)
+            fd.write(CompiledLoader.HEADER.pack(len(header)))
+            fd.write(header)
+            fd.write(b'\0' * (-fd.tell() % CompiledLoader.ALIGNMENT))
+            data.seek(0)
+            fileutils.copy_fileobj(data, fd)
+    os.remove(tmp + '.data')
+    os.rename(tmp, target)
+    LOGGER.info('Compiled %d files into %s', len(files), target)
+    loader.template_index.save()
@@ -21,18 +21,36 @@
 # THE SOFTWARE.
 
 import os
+import re
+import json
+import socket
+import sqlite3
 import logging
-import urllib2
-import shelve
 import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+try:
+    import httplib
+    from urlparse import urlsplit, urljoin
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import urlsplit, urljoin
 
 import loader
+import fileutils
+from versions import Requirement, VersionIndex, version_key
 
 LOGGER = logging.getLogger('inception.' + __name__)
 DATA_PATH = os.path.join(os.environ['HOME'], '.inception')
 
 
-class DownloaderException(object):
+class DownloaderException(Exception):
+    pass
+
+
+class DownloadError(DownloaderException):
     pass
 
 
@@ -44,72 +62,541 @@ class VersionNotFoundError(DownloaderException):
     pass
 
 
+class ConnectionPool(object):
+    """Keep-alive HTTP connections, up to `size` idle ones by host."""
+    def __init__(self, size=4, timeout=30):
+        self._size = size
+        self._timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def open(self, url, headers=None):
+        """GETs `url` and gives the response. The connection goes back to
+        the pool if the response was fully read."""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        connection, reused = self._acquire(key)
+        try:
+            response = self._request(connection, path, headers)
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if not reused:
+                raise
+            LOGGER.debug('Stale connection to %s, reconnecting', parts.netloc)
+            connection = self._connect(key)
+            response = self._request(connection, path, headers)
+        try:
+            yield response
+        except BaseException:
+            connection.close()
+            raise
+        self._release(key, connection, response)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _request(self, connection, path, headers):
+        connection.request('GET', path, headers=headers or {})
+        return connection.getresponse()
+
+    def _acquire(self, key):
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop(), True
+        return self._connect(key), False
+
+    def _connect(self, key):
+        scheme, netloc = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self._timeout)
+        return httplib.HTTPConnection(netloc, timeout=self._timeout)
+
+    def _release(self, key, connection, response):
+        if response.will_close or not response.isclosed():
+            connection.close()
+            return
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self._size:
+                connections.append(connection)
+                return
+        connection.close()
+
+
 class Downloader(object):
+    """Fetches packages and indexes.
+
+    Connections are kept alive and reused, and downloads are stored in
+    CACHE with their ETag and Last-Modified headers, so they are only
+    transferred again when they changed in the server.
+    """
     CACHE = os.path.join(DATA_PATH, 'cache')
     INDEX_URL = ''
+    MAX_REDIRECTS = 5
+
+    def __init__(self, jobs=4, cache=None):
+        self._jobs = jobs
+        self._cache = cache or self.CACHE
+        self._pool = ConnectionPool(size=jobs)
 
     def fetch_file(self, url):
-        response = urllib2.urlopen(url)
-        return response.read()
+        with self._open(url) as (url, response):
+            self._check(url, response)
+            return response.read()
 
     def fetch_index(self):
         return self.fetch_file(self.INDEX_URL)
 
+    def download(self, url, target=None):
+        """Stores `url` in `target` (by default, a file in the cache).
 
-class Database(object):
-    DATA_FILE = os.path.join(DATA_PATH, 'data.shelve')
+        If `target` was downloaded before, the server is asked whether it
+        changed and it is only transferred again if it did. Returns the
+        path to `target`.
+        """
+        target = target or self.cache_path(url)
+        meta = self._read_meta(target)
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        with self._open(url, headers) as (url, response):
+            if response.status == 304:
+                LOGGER.debug('Not modified: %s', url)
+                return target
+            self._check(url, response)
+            LOGGER.debug('Downloading %s into %s', url, target)
+            directory = os.path.dirname(target)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            partial = target + '.part'
+            with open(partial, 'wb') as fd:
+                shutil.copyfileobj(response, fd, fileutils.CHUNK_SIZE)
+            os.rename(partial, target)
+            self._write_meta(target, dict(
+                url=url,
+                etag=response.getheader('ETag'),
+                last_modified=response.getheader('Last-Modified'),
+            ))
+        return target
 
-    def get(self, name):
+    def download_many(self, urls, targets=None):
+        """Downloads several urls at once. Returns the list of targets."""
+        targets = targets or [None] * len(urls)
+        pool = ThreadPool(self._jobs)
         try:
-            data = self._open()
-            return data[name]
+            return pool.map(lambda x: self.download(*x), zip(urls, targets))
         finally:
-            data.close()
+            pool.close()
+            pool.join()
+
+    def cache_path(self, url):
+        parts = urlsplit(url)
+        name = os.path.basename(parts.path) or 'index'
+        return os.path.join(self._cache, parts.netloc,
+                            fileutils.hash_text(url)[:16], name)
+
+    def close(self):
+        self._pool.close()
 
-    def insert(self, name, url):
+    @contextmanager
+    def _open(self, url, headers=None):
+        for _ in range(self.MAX_REDIRECTS + 1):
+            with self._pool.open(url, headers) as response:
+                location = response.getheader('Location')
+                if response.status in (301, 302, 303, 307, 308) and location:
+                    response.read()
+                    url = urljoin(url, location)
+                    continue
+                yield url, response
+                return
+        raise DownloadError('Too many redirects: %s' % url)
+
+    def _check(self, url, response):
+        if response.status != 200:
+            raise DownloadError('%s: %s %s' % (url, response.status,
+                                               response.reason))
+
+    def _read_meta(self, target):
+        if not os.path.exists(target):
+            return {}
         try:
-            data = self._open()
-            data[name] = url
-        finally:
-            data.close()
+            with open(target + '.meta') as fd:
+                return json.load(fd)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write_meta(self, target, meta):
+        with open(target + '.meta', 'w') as fd:
+            json.dump(meta, fd)
+
+
+class Database(object):
+    """Catalog of known templates, stored in SQLite.
+
+    It keeps name, version, url, hash and description of every template
+    version and the words in its name and description, indexed for prefix
+    and keyword searches. WAL mode allows readers while another process
+    writes.
+    """
+    DATA_FILE = os.path.join(DATA_PATH, 'catalog.sqlite')
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS templates (
+            name TEXT NOT NULL,
+            version TEXT NOT NULL DEFAULT '',
+            url TEXT,
+            hash TEXT,
+            description TEXT,
+            PRIMARY KEY (name, version)
+        );
+        CREATE TABLE IF NOT EXISTS keywords (
+            word TEXT NOT NULL,
+            name TEXT NOT NULL,
+            version TEXT NOT NULL,
+            PRIMARY KEY (word, name, version)
+        );
+        CREATE INDEX IF NOT EXISTS keywords_template
+            ON keywords (name, version);
+    """
+    FIELDS = ('name', 'version', 'url', 'hash', 'description')
+
+    def __init__(self, path=None):
+        self.path = path or self.DATA_FILE
+        self._local = threading.local()
+
+    def get(self, name, version=None):
+        """url of template `name` (its newest version, if not given)."""
+        if version is None:
+            rows = self._query('SELECT url, version FROM templates '
+                               'WHERE name = ?', (name, ))
+            rows.sort(key=lambda x: version_key(x[1]), reverse=True)
+        else:
+            rows = self._query('SELECT url FROM templates '
+                               'WHERE name = ? AND version = ?',
+                               (name, version))
+        if not rows:
+            raise KeyError(name)
+        return rows[0][0]
+
+    def insert(self, name, url, version='', hash=None, description=None):
+        self.upsert_many([dict(name=name, url=url, version=version, hash=hash,
+                               description=description)])
 
-    def _open(self):
-        if not os.path.exists(DATA_PATH):
-            os.path.makedirs(DATA_PATH)
+    def insert_loader(self, loader, url, hash=None):
+        """Registers a template from its metadata."""
+        self.insert(loader.name, url, loader.version_str or '', hash,
+                    loader.description)
 
-        return shelve.open(self.DATA_FILE)
+    def upsert_many(self, records):
+        """Inserts or replaces many templates (dicts with FIELDS) in a single
+        transaction."""
+        rows = [tuple(x.get(f) if f != 'version' else (x.get(f) or '')
+                      for f in self.FIELDS) for x in records]
+        keywords = [(word, row[0], row[1]) for row in rows
+                    for word in self._words(row[0], row[4])]
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                'DELETE FROM keywords WHERE name = ? AND version = ?',
+                [row[:2] for row in rows])
+            connection.executemany(
+                'INSERT OR REPLACE INTO templates (%s) VALUES (?, ?, ?, ?, ?)'
+                % ', '.join(self.FIELDS), rows)
+            connection.executemany(
+                'INSERT OR IGNORE INTO keywords (word, name, version) '
+                'VALUES (?, ?, ?)', keywords)
+        return len(rows)
+
+    def import_index(self, data):
+        """Imports an index, as returned by Downloader.fetch_index: a JSON
+        list of templates or an object from names to urls."""
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        index = json.loads(data)
+        if isinstance(index, dict):
+            index = [dict(name=k, url=v) for k, v in index.items()]
+        return self.upsert_many(index)
+
+    def list(self, prefix=''):
+        """Templates whose name starts with `prefix`."""
+        if not prefix:
+            return self._records('SELECT %s FROM templates ORDER BY name',
+                                 ())
+        return self._records(
+            'SELECT %s FROM templates WHERE name >= ? AND name < ? '
+            'ORDER BY name', (prefix, prefix + u'\uffff'))
+
+    def search(self, text):
+        """Templates with words (in name or description) starting with each
+        of the words in `text`."""
+        words = self._words(text)
+        if not words:
+            return self.list()
+        condition = ('EXISTS (SELECT 1 FROM keywords k WHERE k.name = t.name '
+                     'AND k.version = t.version AND k.word >= ? '
+                     'AND k.word < ?)')
+        params = []
+        for word in words:
+            params.extend([word, word + u'\uffff'])
+        return self._records(
+            'SELECT %%s FROM templates t WHERE %s ORDER BY name'
+            % ' AND '.join([condition] * len(words)), params)
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _words(self, *texts):
+        return sorted(set(word for text in texts if text
+                          for word in re.findall(r'\w+', text.lower(),
+                                                 re.UNICODE)))
+
+    def _records(self, sql, params):
+        rows = self._query(sql % ', '.join(self.FIELDS), params)
+        return [dict(zip(self.FIELDS, row)) for row in rows]
+
+    def _query(self, sql, params):
+        return self._connection().execute(sql, params).fetchall()
+
+    def _connection(self):
+        """One connection by thread, as sqlite3 requires."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(self.SCHEMA)
+            self._local.connection = connection
+        return connection
+
+
+class BlobStore(object):
+    """Files stored by the sha1 of their content, so equal files are stored
+    just once."""
+    def __init__(self, path):
+        self.path = path
+
+    def blob_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def put(self, path_content):
+        """Stores the content of `path_content` unless it is already stored.
+        Returns the tuple (digest, size)."""
+        with path_content.open() as fd:
+            digest = fileutils.hash_fileobj(fd)
+        blob = self.blob_path(digest)
+        if not os.path.exists(blob):
+            directory = os.path.dirname(blob)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            tmp = '%s.%d.tmp' % (blob, os.getpid())
+            path_content.copy_to(tmp)
+            if path_content.permission is not None:
+                os.chmod(tmp, path_content.permission)
+            os.rename(tmp, blob)
+        return digest, os.path.getsize(blob)
+
+    def materialize(self, digest, target, permission=None):
+        """Creates `target` with the content of the blob: as a hard link if
+        possible, or as a clone or a copy if not."""
+        blob = self.blob_path(digest)
+        if permission is None or os.stat(blob).st_mode == permission:
+            try:
+                os.link(blob, target)
+                return
+            except OSError as e:
+                LOGGER.debug('Cannot link %s: %s', target, e)
+        fileutils.clone_file(blob, target)
+        if permission is not None:
+            os.chmod(target, permission)
+
+    def digests(self):
+        if not os.path.exists(self.path):
+            return
+        for prefix in os.listdir(self.path):
+            directory = os.path.join(self.path, prefix)
+            for name in os.listdir(directory):
+                if not name.endswith('.tmp'):
+                    yield prefix + name
+
+    def remove(self, digest):
+        path = self.blob_path(digest)
+        size = os.path.getsize(path)
+        os.remove(path)
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass  # not empty yet
+        return size
 
 
 class FileManager(object):
     REPO_PATH = os.path.join(DATA_PATH, 'repository')
+    BLOBS_PATH = os.path.join(DATA_PATH, 'blobs')
+    INDEX_FILE = 'versions.json'
+    TREE_FILE = 'tree.json'
+
+    def __init__(self):
+        self.blobs = BlobStore(self.BLOBS_PATH)
 
     def get_list_of_versions(self, name):
-        path = os.path.join(self.REPO_PATH, name)
-        if not os.path.exits(path):
-            return []
-        return [x.split('.') for x in os.listdir(path)]
+        """Versions of `name` in the repository, from oldest to newest."""
+        return self._index(name).versions
+
+    def latest(self, name):
+        return self._index(name).latest
+
+    def resolve(self, spec):
+        """Returns (name, version) for a requirement like ``name>=1.2,<2``.
+        Without constraints, the latest version is chosen."""
+        requirement = Requirement(spec)
+        version = self._index(requirement.name).resolve(requirement)
+        if version is None:
+            raise VersionNotFoundError(spec)
+        return requirement.name, version
 
     def load(self, name, version=None):
-        version = version or max(self.get_list_of_versions(name))
+        if version is None:
+            name, version = self.resolve(name)
         path = os.path.join(self.REPO_PATH, name, version)
         zipfile = os.path.join(path, 'package.zip')
 
         if not os.path.exists(path):
             raise VersionNotFoundError()
+        if os.path.exists(os.path.join(path, self.TREE_FILE)):
+            return loader.get_loader(self._materialize(path))
         if not os.path.exists(zipfile):
             raise PackageNotFoundError()
         return loader.get_loader(zipfile)
 
+    def list_templates(self):
+        """Metadata of the latest version of each stored template. It is
+        read from the stored trees, without loading any template."""
+        result = []
+        if not os.path.exists(self.REPO_PATH):
+            return result
+        for name in sorted(os.listdir(self.REPO_PATH)):
+            version = self.latest(name)
+            if version is None:
+                continue
+            path = os.path.join(self.REPO_PATH, name, version)
+            if os.path.exists(os.path.join(path, self.TREE_FILE)):
+                metadata = self._tree(path)['metadata']
+            else:
+                metadata = self.load(name, version).metadata
+            result.append(metadata)
+        return result
+
+    def gc(self):
+        """Removes the blobs not used by any stored version. Returns the
+        number of blobs removed and their size."""
+        used = set()
+        if os.path.exists(self.REPO_PATH):
+            for name in os.listdir(self.REPO_PATH):
+                for version in self.get_list_of_versions(name):
+                    path = os.path.join(self.REPO_PATH, name, version)
+                    if os.path.exists(os.path.join(path, self.TREE_FILE)):
+                        used.update(x['hash'] for x in self._tree(path)
+                                    ['entries'] if x['type'] == 'file')
+        count = size = 0
+        for digest in list(self.blobs.digests()):
+            if digest not in used:
+                size += self.blobs.remove(digest)
+                count += 1
+        LOGGER.info('Removed %d unused blobs (%d bytes)', count, size)
+        return count, size
+
+    def _tree(self, path):
+        with open(os.path.join(path, self.TREE_FILE)) as fd:
+            return json.load(fd)
+
+    def _materialize(self, path):
+        """Builds the stored version in `path` from its blobs, if it was not
+        built yet. Returns the directory with the template."""
+        package = os.path.join(path, 'package')
+        if os.path.exists(package):
+            return package
+        LOGGER.debug('Materializing %s', package)
+        tmp = tempfile.mkdtemp(dir=path)
+        for entry in self._tree(path)['entries']:
+            target = os.path.join(tmp, *entry['path'].split('/'))
+            if entry['type'] == 'dir':
+                os.makedirs(target)
+                continue
+            directory = os.path.dirname(target)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self.blobs.materialize(entry['hash'], target, entry['mode'])
+        for entry in self._tree(path)['entries']:
+            if entry['type'] == 'dir' and entry['mode'] is not None:
+                os.chmod(os.path.join(tmp, *entry['path'].split('/')),
+                         entry['mode'])
+        try:
+            os.rename(tmp, package)
+        except OSError:
+            # built at the same time by another process
+            shutil.rmtree(tmp)
+        return package
+
+    def _index(self, name):
+        """Version index of `name`, built from the repository directory the
+        first time."""
+        path = os.path.join(self.REPO_PATH, name)
+        index = VersionIndex(os.path.join(path, self.INDEX_FILE))
+        if not index.exists() and os.path.isdir(path):
+            index.rebuild([x for x in os.listdir(path)
+                           if os.path.isdir(os.path.join(path, x))])
+        return index
+
     def save(self, source):
+        """Stores the template in `source`.
+
+        Files are stored as blobs, by content, and the version just keeps
+        the tree of paths, permissions and blob hashes, so a new version
+        only takes the space of the files that changed.
+        """
         zloader = loader.get_loader(source)
         zloader.validate()
         path = os.path.join(self.REPO_PATH, zloader.name, zloader.version_str)
-        zipfile = os.path.join(path, 'package.zip')
 
         if not os.path.exists(path):
             os.makedirs(path)
         LOGGER.debug('Storing in %s', path)
-        if os.path.isfile(source):
-            shutil.copy2(source, path)
-        elif os.path.isdir(source):
-            shutil.copytree(source, path)
+        entries = []
+        stored = 0
+        for path_content in zloader.walk(''):
+            relative = path_content.relative_path.replace(os.sep, '/')
+            entry = dict(path=relative, mode=path_content.permission)
+            if path_content.is_dir:
+                entry['type'] = 'dir'
+            else:
+                entry['type'] = 'file'
+                entry['hash'], entry['size'] = self.blobs.put(path_content)
+                stored += entry['size']
+            entries.append(entry)
+        tree = dict(metadata=zloader.metadata, entries=entries)
+        tmp = os.path.join(path, self.TREE_FILE + '.tmp')
+        with open(tmp, 'w') as fd:
+            json.dump(tree, fd, indent=1, default=str)
+        os.rename(tmp, os.path.join(path, self.TREE_FILE))
+        package = os.path.join(path, 'package')
+        if os.path.exists(package):
+            shutil.rmtree(package)
+        LOGGER.debug('Stored %d entries (%d bytes)', len(entries), stored)
+        self._index(zloader.name).add(zloader.version_str)
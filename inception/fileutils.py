@@ -0,0 +1,179 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import io
+import os
+import shutil
+import hashlib
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOGGER = logging.getLogger('inception.' + __name__)
+CHUNK_SIZE = 1024 * 1024
+FICLONE = 0x40049409
+
+
+def copy_file(source, target, offset=0, size=None):
+    """Copies `source` into `target` without loading it in memory.
+
+    `offset` and `size` allow to copy just a range of `source`.
+    """
+    with io.open(source, 'rb') as fsrc:
+        fsrc.seek(offset)
+        with io.open(target, 'wb') as fdst:
+            copy_fileobj(fsrc, fdst, size)
+
+
+def temporary_path(target):
+    """Hidden path, next to `target`, where it can be written before being
+    renamed into place."""
+    directory, name = os.path.split(target)
+    return os.path.join(directory, '.%s.%d.%d.tmp' % (
+        name, os.getpid(), threading.current_thread().ident))
+
+
+def write_chunks(target, chunks, permission=None):
+    """Writes the text or bytes `chunks` into `target`, with memory bounded
+    by CHUNK_SIZE whatever the size of the content.
+
+    Chunks are written in batches into a temporary file, renamed to
+    `target` once complete, so `target` is never left partially written.
+    Text is encoded as UTF-8. Returns the sha1 hex digest of the content.
+    """
+    tmp = temporary_path(target)
+    digest = hashlib.sha1()
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        with io.open(fd, 'wb', buffering=CHUNK_SIZE) as out:
+            pending = []
+            size = 0
+            for chunk in chunks:
+                pending.append(chunk)
+                size += len(chunk)
+                if size >= CHUNK_SIZE:
+                    _write_batch(out, digest, pending)
+                    pending = []
+                    size = 0
+            _write_batch(out, digest, pending)
+        if permission is not None:
+            os.chmod(tmp, permission)
+        os.rename(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return digest.hexdigest()
+
+
+def _write_batch(out, digest, chunks):
+    if not chunks:
+        return
+    data = chunks[0][:0].join(chunks)
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    digest.update(data)
+    out.write(data)
+
+
+def clone_file(source, target):
+    """Copies `source` into `target` sharing their data blocks (reflink) if
+    the file system allows it, or with copy_file if not."""
+    with io.open(source, 'rb') as fsrc:
+        with io.open(target, 'wb') as fdst:
+            if fcntl is not None:
+                try:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                    return
+                except (IOError, OSError) as e:
+                    LOGGER.debug('reflink not available: %s', e)
+            copy_fileobj(fsrc, fdst)
+
+
+def copy_fileobj(fsrc, fdst, size=None):
+    """Copies `size` bytes (or up to the end) from `fsrc` current position
+    into `fdst`.
+
+    When both are real files the copy is done by the kernel (sendfile), so
+    the data never goes through user space. Otherwise it is copied in
+    chunks of CHUNK_SIZE.
+    """
+    sendfile = getattr(os, 'sendfile', None)
+    if sendfile is not None:
+        try:
+            infd = fsrc.fileno()
+            outfd = fdst.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            pass
+        else:
+            fdst.flush()
+            offset = fsrc.tell()
+            end = None if size is None else offset + size
+            try:
+                while end is None or offset < end:
+                    count = CHUNK_SIZE
+                    if end is not None:
+                        count = min(count, end - offset)
+                    sent = sendfile(outfd, infd, offset, count)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return
+            except OSError as e:
+                LOGGER.debug('sendfile not available: %s', e)
+                fsrc.seek(offset)
+                if end is not None:
+                    size = end - offset
+    if size is None:
+        shutil.copyfileobj(fsrc, fdst, CHUNK_SIZE)
+        return
+    while size > 0:
+        chunk = fsrc.read(min(CHUNK_SIZE, size))
+        if not chunk:
+            break
+        fdst.write(chunk)
+        size -= len(chunk)
+
+
+def hash_fileobj(fd):
+    """sha1 hex digest of the content of `fd`, read in chunks."""
+    digest = hashlib.sha1()
+    while True:
+        chunk = fd.read(CHUNK_SIZE)
+        if not chunk:
+            return digest.hexdigest()
+        digest.update(chunk)
+
+
+def hash_file(path):
+    with io.open(path, 'rb') as fd:
+        return hash_fileobj(fd)
+
+
+def hash_text(text):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
@@ -20,26 +20,289 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import io
 import os
+import sys
+import ast
+import struct
+import mmap
+import json
+import codecs
+import marshal
+import hashlib
+import threading
 import logging
 import zipfile
+import posixpath
 
-from commands import COMMANDS
+from commands import COMMANDS, TEMPLATES
+import fileutils
 
-__all__ = ('get_loader', )
+__all__ = ('get_loader', 'load_template')
 
 LOGGER = logging.getLogger('inception.' + __name__)
+CACHE_PATH = os.path.join(os.environ['HOME'], '.inception', 'cache')
+CODE_CACHE = os.path.join(CACHE_PATH, 'code')
+BINARY_EXTENSIONS = frozenset((
+    '.png', '.jpg', '.jpeg', '.gif', '.ico', '.bmp', '.webp', '.pdf',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.whl', '.egg', '.jar', '.war',
+    '.so', '.dll', '.dylib', '.exe', '.pyc', '.class', '.o', '.a',
+    '.woff', '.woff2', '.ttf', '.otf', '.eot', '.mp3', '.mp4', '.wav',
+    '.sqlite', '.db', '.bin',
+))
+TEXT_EXTENSIONS = frozenset((
+    '.txt', '.py', '.rst', '.md', '.cfg', '.ini', '.toml', '.yml', '.yaml',
+    '.json', '.xml', '.html', '.css', '.js', '.sh', '.c', '.h', '.java',
+))
+SNIFF_SIZE = 8192
+JINJA_MARKUP = ('{{', '{%', '{#')
+
+
+def is_binary_data(data):
+    """Whether a chunk from the beginning of a file looks binary: it has NUL
+    bytes or is not valid UTF-8."""
+    if b'\0' in data:
+        return True
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(data, final=False)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def compile_python(source, filename):
+    """Compiles `source`. Code objects are cached in CODE_CACHE by hash of
+    the source, its filename and the interpreter version, so a file is
+    compiled once."""
+    if not isinstance(source, bytes):
+        source = source.encode('utf-8')
+    key = hashlib.sha1(source)
+    key.update(b'\0' + filename.encode('utf-8'))
+    key.update(b'\0' + sys.version.encode('utf-8'))
+    key = key.hexdigest()
+    path = os.path.join(CODE_CACHE, key)
+    try:
+        with open(path, 'rb') as fd:
+            return marshal.load(fd)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        pass
+    code = compile(source, filename, 'exec')
+    try:
+        if not os.path.exists(CODE_CACHE):
+            os.makedirs(CODE_CACHE)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as fd:
+            marshal.dump(code, fd)
+        os.rename(tmp, path)
+    except (IOError, OSError) as e:
+        LOGGER.debug('Cannot cache %s: %s', filename, e)
+    return code
+
+
+class TemplateIndex(object):
+    """Facts about the files of a template that cost reading them, like
+    whether they are binary.
+
+    Entries are stored in the cache with a stamp of the file they describe
+    (size and mtime, or crc), so they are computed once for each version of
+    each file.
+    """
+    DIRECTORY = os.path.join(CACHE_PATH, 'index')
+
+    def __init__(self, template):
+        key = hashlib.sha1(os.path.abspath(template).encode('utf-8'))
+        self.path = os.path.join(self.DIRECTORY, key.hexdigest() + '.json')
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as fd:
+                    self._entries = json.load(fd)
+            except (IOError, OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, relative_path, stamp, field, compute):
+        """Value of `field` for the file, calling `compute` if it is not
+        known for this `stamp` yet."""
+        entry = self.entries.get(relative_path)
+        if entry is None or entry.get('stamp') != list(stamp):
+            entry = dict(stamp=list(stamp))
+        if field not in entry:
+            entry[field] = compute()
+            with self._lock:
+                self.entries[relative_path] = entry
+                self._dirty = True
+        return entry[field]
+
+    def save(self):
+        if not self._dirty:
+            return
+        try:
+            if not os.path.exists(self.DIRECTORY):
+                os.makedirs(self.DIRECTORY)
+            tmp = '%s.%d.%d.tmp' % (self.path, os.getpid(),
+                                    threading.current_thread().ident)
+            with self._lock:
+                with open(tmp, 'w') as fd:
+                    json.dump(self._entries, fd)
+                self._dirty = False
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            LOGGER.debug('Cannot store template index: %s', e)
+
+
+def literal_assignments(source):
+    """Variables of a module that just assigns literals, like metadata.py
+    usually does, read without executing it. Returns None if the module does
+    anything else."""
+    try:
+        module = ast.parse(source)
+    except SyntaxError:
+        return None
+    result = {}
+    for statement in module.body:
+        try:
+            value = ast.literal_eval(statement.value)
+        except (AttributeError, ValueError, TypeError, SyntaxError):
+            return None
+        if isinstance(statement, ast.Expr):
+            continue
+        if not isinstance(statement, ast.Assign) or \
+                not all(isinstance(x, ast.Name) for x in statement.targets):
+            return None
+        for target in statement.targets:
+            result[target.id] = value
+    return result
 
 
 class PathContent(object):
+    """A file or directory of a template. Its entry in the template `index`
+    is `index_key`, its path in the template, as `relative_path` is
+    relative to the walked directory."""
     CAT_DIR = object()
     CAT_FILE = object()
 
-    def __init__(self, category, relative_path, permission=None, content=None):
+    def __init__(self, category, relative_path, permission=None, content=None,
+                 source=None, opener=None, index=None, stamp=None,
+                 size=None, index_key=None):
         self._category = category
         self.relative_path = relative_path
         self.permission = permission
-        self.content = content
+        self.source = source
+        self._opener = opener
+        self._content = content
+        self._index = index
+        self._index_key = index_key or relative_path
+        self._stamp = stamp
+        self._size = size
+
+    @property
+    def size(self):
+        """Size of the file, without reading it."""
+        if self._size is None and self.is_file:
+            if self._content is not None:
+                return len(self._content)
+            if self.source is not None:
+                return os.stat(self.source).st_size
+        return self._size
+
+    @property
+    def content(self):
+        """File content, as bytes. When it comes from `source` or `opener`
+        it is read on each access and never kept, so prefer `open` for big
+        files."""
+        if self._content is None:
+            with self.open() as fd:
+                return fd.read()
+        return self._content
+
+    @property
+    def text(self):
+        """File content decoded as UTF-8."""
+        content = self.content
+        if isinstance(content, bytes):
+            return content.decode('utf-8')
+        return content
+
+    @property
+    def is_binary(self):
+        """Whether the file is binary, by its extension or, if it is not
+        known, by its first bytes."""
+        return self._indexed('binary', self._detect_binary)
+
+    @property
+    def templated_name(self):
+        """Whether the name has jinja markup. Static names are used as they
+        are, without going through jinja."""
+        return any(x in self.relative_path for x in JINJA_MARKUP)
+
+    @property
+    def body_variables(self):
+        """Names of the variables the content of a jinja template depends
+        on, or None for other files."""
+        if (not self.is_file or not self.relative_path.endswith('.jinja')
+                or self.is_binary):
+            return None
+        return self._indexed('body_variables', lambda: TEMPLATES.variables(
+            self.text))
+
+    def _indexed(self, field, compute):
+        if self._index is None or self._stamp is None:
+            return compute()
+        return self._index.get(self._index_key, self._stamp, field, compute)
+
+    def _detect_binary(self):
+        name = self.relative_path
+        if name.endswith('.jinja'):
+            name = name[:-len('.jinja')]
+        extension = os.path.splitext(name)[1].lower()
+        if extension in BINARY_EXTENSIONS:
+            return True
+        if extension in TEXT_EXTENSIONS:
+            return False
+        with self.open() as fd:
+            return is_binary_data(fd.read(SNIFF_SIZE))
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+
+    def open(self):
+        """Returns a binary file object with the content."""
+        if self._opener is not None:
+            return self._opener()
+        if self.source is not None:
+            return io.open(self.source, 'rb')
+        content = self._content or b''
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        return io.BytesIO(content)
+
+    @property
+    def hash(self):
+        """sha1 hex digest of the content."""
+        with self.open() as fd:
+            return fileutils.hash_fileobj(fd)
+
+    @property
+    def template_code(self):
+        """Compiled jinja code of the content, when it is known without
+        compiling it."""
+        return None
+
+    def copy_to(self, target):
+        """Writes the content into the `target` file, in chunks."""
+        if self._content is None and self.source is not None:
+            fileutils.copy_file(self.source, target)
+            return
+        with self.open() as src:
+            with io.open(target, 'wb') as dst:
+                fileutils.copy_fileobj(src, dst)
 
     @property
     def is_dir(self):
@@ -55,6 +318,13 @@ class Loader(object):
         self.path = path
         self._settings = None
         self._metadata = None
+        self._template_index = None
+
+    @property
+    def template_index(self):
+        if self._template_index is None:
+            self._template_index = TemplateIndex(self.path)
+        return self._template_index
 
     @property
     def settings(self):
@@ -89,7 +359,26 @@ class Loader(object):
         self._settings = self.load_python('settings.py')
 
     def load_metadata(self):
-        self._metadata = self.load_python('metadata.py')
+        source = self.read_source('metadata.py')
+        metadata = literal_assignments(source)
+        if metadata is None:
+            metadata = self.exec_python(source, 'metadata.py')
+        self._metadata = metadata
+
+    def load_python(self, filename):
+        return self.exec_python(self.read_source(filename), filename)
+
+    def exec_python(self, source, filename):
+        return self.exec_code(
+            compile_python(source, os.path.join(self.path, filename)))
+
+    def exec_code(self, code):
+        config = {}
+        exec(code, COMMANDS.copy(), config)
+        return config
+
+    def read_source(self, filename):
+        raise NotImplementedError('Abstract method')
 
     def validate(self):
         assert self.name
@@ -100,15 +389,12 @@ class Loader(object):
 
 
 class PathLoader(Loader):
-    def load_python(self, filename):
-        filename = os.path.join(self.path, filename)
-        config = {}
-        with open(filename) as fd:
-            exec(fd.read(), COMMANDS.copy(), config)
-        return config
+    def read_source(self, filename):
+        with io.open(os.path.join(self.path, filename), 'rb') as fd:
+            return fd.read()
 
     def walk(self, relative_path):
-        source = os.path.join(self.path, relative_path)
+        source = os.path.normpath(os.path.join(self.path, relative_path))
         LOGGER.debug('walking over ("%s")', source)
         basepathlen = len(source) + 1
 
@@ -120,36 +406,309 @@ class PathLoader(Loader):
                 yield PathContent(PathContent.CAT_DIR, path, perms)
             for f in files:
                 origin = os.path.join(root, f)
-                path = origin[basepathlen:]
-                perms = os.stat(origin).st_mode
-                with open(origin) as fd:
-                    yield PathContent(PathContent.CAT_FILE, path, perms,
-                                      fd.read())
+                yield self._file_content(origin, origin[basepathlen:],
+                                         os.stat(origin))
+
+    def get(self, relative_path, path):
+        """Entry of `path`, inside the `relative_path` directory, like
+        those of walk. None if it does not exist."""
+        origin = os.path.join(self.path, relative_path, path)
+        try:
+            stat = os.stat(origin)
+        except OSError:
+            return None
+        if os.path.isdir(origin):
+            return PathContent(PathContent.CAT_DIR, path, stat.st_mode)
+        return self._file_content(origin, path, stat)
+
+    def _file_content(self, origin, path, stat):
+        return PathContent(PathContent.CAT_FILE, path, stat.st_mode,
+                           source=origin, index=self.template_index,
+                           stamp=(stat.st_size, stat.st_mtime),
+                           size=stat.st_size,
+                           index_key=os.path.relpath(origin, self.path))
+
+
+class ZipContent(PathContent):
+    """A member of a zip file.
+
+    Stored (not compressed) members are copied straight from their range
+    in the archive, without going through zipfile.
+    """
+    def __init__(self, loader, info, relative_path):
+        super(ZipContent, self).__init__(
+            PathContent.CAT_FILE, relative_path,
+            permission=loader.permission(info),
+            opener=lambda: loader.archive.open(info),
+            index=loader.template_index,
+            stamp=(info.CRC, info.file_size),
+            size=info.file_size, index_key=info.filename)
+        self._loader = loader
+        self._info = info
+
+    def copy_to(self, target):
+        info = self._info
+        if (info.compress_type != zipfile.ZIP_STORED
+                or info.flag_bits & 0x1):
+            super(ZipContent, self).copy_to(target)
+            return
+        fileutils.copy_file(self._loader.path, target,
+                            self._loader.data_offset(info), info.file_size)
 
 
 class ZipLoader(Loader):
+    def __init__(self, path):
+        super(ZipLoader, self).__init__(path)
+        self._archive = None
+        self._index = None
+        self._dir_permissions = {}
+
+    @property
+    def archive(self):
+        if self._archive is None:
+            self._archive = zipfile.ZipFile(self.path)
+        return self._archive
+
+    @property
+    def index(self):
+        """Directories in the archive, as a dict from its name to the tuple
+        (subdirectories, file members)."""
+        if self._index is None:
+            self._index = self._build_index()
+        return self._index
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def read_source(self, filename):
+        with self.archive.open(filename) as fd:
+            return fd.read()
+
+    def walk(self, relative_path):
+        prefix = relative_path.strip('/')
+        LOGGER.debug('walking over ("%s:%s")', self.path, prefix)
+        if prefix not in self.index:
+            return
+        start = len(prefix) + 1 if prefix else 0
+        pending = [prefix]
+        while pending:
+            dirs, files = self.index[pending.pop()]
+            for d in dirs:
+                yield PathContent(PathContent.CAT_DIR, d[start:],
+                                  self._dir_permissions.get(d))
+            for info in files:
+                yield ZipContent(self, info, info.filename[start:])
+            pending.extend(reversed(dirs))
+
+    def permission(self, info):
+        return (info.external_attr >> 16) or None
+
+    def data_offset(self, info):
+        """Offset of the member data, just after its local header."""
+        with io.open(self.path, 'rb') as fd:
+            fd.seek(info.header_offset)
+            header = struct.unpack(zipfile.structFileHeader,
+                                   fd.read(zipfile.sizeFileHeader))
+        return (info.header_offset + zipfile.sizeFileHeader
+                + header[zipfile._FH_FILENAME_LENGTH]
+                + header[zipfile._FH_EXTRA_FIELD_LENGTH])
+
+    def _build_index(self):
+        index = {}
+        for info in self.archive.infolist():
+            name = info.filename.rstrip('/')
+            if info.filename.endswith('/'):
+                self._add_dir(index, name)
+                self._dir_permissions[name] = self.permission(info)
+                continue
+            parent = posixpath.dirname(name)
+            self._add_dir(index, parent)
+            index[parent][1].append(info)
+        return index
+
+    def _add_dir(self, index, name):
+        if name in index:
+            return
+        index[name] = ([], [])
+        if name:
+            parent = posixpath.dirname(name)
+            self._add_dir(index, parent)
+            index[parent][0].append(name)
+
+
+class CompiledContent(PathContent):
+    """A file of a compiled package. Everything about it comes from the
+    package index, and its body is read from the memory map."""
+    def __init__(self, loader, entry, relative_path):
+        super(CompiledContent, self).__init__(
+            PathContent.CAT_DIR if entry['dir'] else PathContent.CAT_FILE,
+            relative_path, entry['permission'], size=entry.get('size'))
+        self._loader = loader
+        self._entry = entry
+
+    @property
+    def content(self):
+        return self._loader.read(self._entry['body'])
+
+    @property
+    def is_binary(self):
+        return self._entry['binary']
+
+    @property
+    def body_variables(self):
+        return self._entry.get('body_variables')
+
+    @property
+    def hash(self):
+        return self._entry['hash']
+
+    @property
+    def template_code(self):
+        return self._loader.code(self._entry)
+
+    def open(self):
+        return io.BytesIO(self.content)
+
+    def copy_to(self, target):
+        offset, size = self._entry['body']
+        fileutils.copy_file(self._loader.path, target,
+                            self._loader.data_offset + offset, size)
+
+
+class CompiledLoader(Loader):
+    """Loader of the packages made by the compile action.
+
+    A package is a single file: the MAGIC line, the size of the header as
+    8 bytes, the header in JSON and, aligned to a page, the data. The
+    header has the metadata and an index with every file of the template,
+    and the data the uncompressed bodies, the code of the settings and of
+    each jinja template, ready to be used without walking, reading or
+    compiling anything when the interpreter and jinja versions match.
+    """
+    MAGIC = b'INCEPTION PACKAGE 1\n'
+    HEADER = struct.Struct('<Q')
+    ALIGNMENT = 4096
+
+    def __init__(self, path):
+        super(CompiledLoader, self).__init__(path)
+        self._map = None
+        self._header = None
+        self._codes = {}
+
+    @classmethod
+    def is_package(cls, path):
+        try:
+            with io.open(path, 'rb') as fd:
+                return fd.read(len(cls.MAGIC)) == cls.MAGIC
+        except (IOError, OSError):
+            return False
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._open()
+        return self._header
+
+    @property
+    def data_offset(self):
+        start = len(self.MAGIC) + self.HEADER.size + self.header['size']
+        return -(-start // self.ALIGNMENT) * self.ALIGNMENT
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def read(self, extent):
+        """Bytes of the data section at `extent`, an (offset, size)
+        pair."""
+        offset, size = extent
+        start = self.data_offset + offset
+        return self._map[start:start + size]
+
+    def code(self, entry):
+        """Jinja code of the template of `entry`, or None if it must be
+        compiled."""
+        if entry.get('module') is None:
+            return None
+        if entry['path'] not in self._codes:
+            self._codes[entry['path']] = self._load_code(
+                entry, '<template %s>' % entry['path'])
+        return self._codes[entry['path']]
+
+    def load_metadata(self):
+        self._metadata = self.header['metadata']
+
     def load_python(self, filename):
-        with zipfile.ZipFile(self.path) as z:
-            with z.open(filename) as fd:
-                config = {}
-                exec(fd.read(), COMMANDS.copy(), config)
-        return config
+        entry = self.header['code'].get(filename)
+        code = entry and self._load_code(entry, filename)
+        if code is None:
+            return super(CompiledLoader, self).load_python(filename)
+        return self.exec_code(code)
+
+    def read_source(self, filename):
+        for entry in self.header['files']:
+            if entry['path'] == filename and not entry['dir']:
+                return self.read(entry['body'])
+        raise IOError('No file %s in %s' % (filename, self.path))
 
     def walk(self, relative_path):
-        dirs = set()
-        with zipfile.ZipFile(self.path) as z:
-            for name in z.namelist():
-                path = os.path.dirname(name)
-                if path not in dirs:
-                    yield PathContent(PathContent.CAT_DIR, path)
-                    dirs.add(path)
-                yield PathContent(PathContent.CAT_FILE, name,
-                                  None, z.read(name))
+        prefix = relative_path.strip('/')
+        start = len(prefix) + 1 if prefix else 0
+        for entry in self.header['files']:
+            path = entry['path']
+            if start and not path.startswith(prefix + '/'):
+                continue
+            yield CompiledContent(self, entry, path[start:])
+
+    def _open(self):
+        with io.open(self.path, 'rb') as fd:
+            self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        start = len(self.MAGIC)
+        size, = self.HEADER.unpack(self._map[start:start + self.HEADER.size])
+        start += self.HEADER.size
+        self._header = json.loads(
+            self._map[start:start + size].decode('utf-8'))
+        self._header['size'] = size
+
+    def _load_code(self, entry, filename):
+        """Compiled code of `entry`: python files need the same python
+        version, and jinja templates the same jinja version as well."""
+        is_template = entry.get('module') is not None
+        if is_template and self.header['jinja'] != jinja_version():
+            return None
+        if entry.get('code') and self.header['python'] == sys.version:
+            return marshal.loads(self.read(entry['code']))
+        if is_template:
+            return compile(self.read(entry['module']), filename, 'exec')
+        return None
+
+
+def jinja_version():
+    import jinja2
+    return jinja2.__version__
 
 
 def get_loader(path):
+    """Loader of the template in `path`: a directory, a compiled package or
+    a zip file."""
     if os.path.isdir(path):
         return PathLoader(path)
+    if CompiledLoader.is_package(path):
+        return CompiledLoader(path)
     if zipfile.is_zipfile(path):
         return ZipLoader(path)
-    # FIXME: raise exception
+    raise ValueError('%s is not a template directory, compiled package or '
+                     'zip file' % path)
+
+
+def load_template(path):
+    """Loader of a template path or of a stored template, given by name
+    with optional version constraints, like "name>=1.2,<2"."""
+    if os.path.exists(path):
+        return get_loader(path)
+    # the downloader is only imported for stored templates
+    import downloader
+    return downloader.FileManager().load(path)
@@ -24,41 +24,28 @@
 
 from __future__ import  absolute_import, print_function, unicode_literals
 
+import os
+import sys
 import argparse
 import logging
 
 from version import APP
-from loader import get_loader
-from commands import DEFAULT_PROGRAM
-import downloader
+from loader import load_template
+from runner import Runner
+from variables import Options
+from archive import is_archive
+from profiler import PROFILER
 
 LOGGER = logging.getLogger('inception.' + __name__)
 
 
-class Runner(object):
-    def __init__(self, loader):
-        self._loader = loader
-
-    def run(self, output):
-        program = (self._loader.settings.get('PROGRAM')
-                   or DEFAULT_PROGRAM)
-
-        for command in program:
-            LOGGER.debug('New program command: %s', command)
-            if callable(command):
-                command(self._loader, output)
-                continue
-            else:
-                LOGGER.error('Unsupported command: %s', command)
-
-
 def logging_setup(verbose):
     if verbose:
         FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
         DATEFORMAT = ''
         LEVEL = logging.DEBUG
     else:
-        FORMAT = '%()s %(message)s'
+        FORMAT = '%(message)s'
         DATEFORMAT = ''
         LEVEL = logging.INFO
     formatter = logging.Formatter(FORMAT, DATEFORMAT)
@@ -72,14 +59,71 @@ def logging_setup(verbose):
 
 def main():
     parser = argparse.ArgumentParser(description=APP.description)
-    parser.add_argument('action', choices=['apply', 'add'], default='apply',
+    parser.add_argument('action',
+                        choices=['apply', 'add', 'compile', 'batch', 'list',
+                                 'gc', 'serve'],
+                        default='apply',
                         nargs='?',
                         help="Action to be performed")
-    parser.add_argument('--template-path', dest="path", required=True,
-                        help='Path to template to be applied.')
+    parser.add_argument('--template-path', dest="path",
+                        help='Path to template to be applied, or name of a '
+                        'stored template with optional version constraints, '
+                        'like "name>=1.2,<2".')
 
     parser.add_argument('-o', '--output',
-                        help='Where the output should be put.')
+                        help='Where the output should be put: a directory, '
+                        'an archive (.zip, .tar, .tar.gz, .tgz, .tar.bz2 or '
+                        '.tar.xz) or "-" for a tar stream to the standard '
+                        'output.')
+
+    parser.add_argument('--skip-run', action='store_true', default=False,
+                        help='Skip the run commands of the template when '
+                        'the output is an archive.')
+
+    parser.add_argument('--update', action='store_true', default=False,
+                        help='Rewrite generated files whose template or '
+                        'answers changed, unless they were modified.')
+
+    parser.add_argument('--plan', action='store_true', default=False,
+                        help='Show, as JSON, the files that apply would '
+                        'create, skip or find in conflict, without writing '
+                        'anything.')
+
+    parser.add_argument('--watch', action='store_true', default=False,
+                        help='Keep applying the edits of a template '
+                        'directory to the output, with the same answers.')
+
+    parser.add_argument('--answers',
+                        help='JSON lines file with the answers and output of '
+                        'each project to be created by the batch action.')
+
+    parser.add_argument('--parallel', type=int, default=1,
+                        help='Number of projects created at once by the '
+                        'batch action.')
+
+    parser.add_argument('--port', type=int, default=8765,
+                        help='Localhost port where the serve action listens '
+                        'for render requests.')
+
+    parser.add_argument('--socket',
+                        help='Unix socket where the serve action listens, '
+                        'instead of a port.')
+
+    parser.add_argument('--cache-size', type=int, default=32,
+                        help='Number of templates kept loaded by the serve '
+                        'action.')
+
+    parser.add_argument('--output-root',
+                        help='Directory where the serve action may write '
+                        'projects. Without it, projects are only returned '
+                        'as tar streams.')
+
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of files to be written in parallel.')
+
+    parser.add_argument('--profile', metavar='TRACE',
+                        help='Store timings in TRACE, in Chrome trace '
+                        'format, and show the slowest commands and files.')
 
     parser.add_argument('--verbose', action="store_true", default=False,
                         help='Verbose mode.')
@@ -87,14 +131,70 @@ def main():
     args = parser.parse_args()
 
     logging_setup(args.verbose)
-
+    Options().update(jobs=args.jobs, update=args.update,
+                     skip_run=args.skip_run)
+    if args.profile:
+        PROFILER.enable()
+    try:
+        run_action(parser, args)
+    finally:
+        if args.profile:
+            PROFILER.write(args.profile)
+            LOGGER.info('Profile stored in %s\n%s', args.profile,
+                        PROFILER.summary())
+
+
+def run_action(parser, args):
+    # modules are imported by the actions using them, to start faster
+    if args.action not in ('list', 'gc', 'serve') and args.path is None:
+        parser.error('--template-path is required')
     if args.action == 'apply':
-        loader = get_loader(args.path)
+        loader = load_template(args.path)
         runner = Runner(loader)
-        runner.run(args.output)
+        if args.plan:
+            runner.plan(args.output).dump(sys.stdout)
+        elif args.watch:
+            import watcher
+            if (not os.path.isdir(args.path) or args.output is None
+                    or is_archive(args.output)):
+                parser.error('--watch requires a template directory and an '
+                             'output directory')
+            try:
+                watcher.Watcher(loader, args.output).run()
+            except KeyboardInterrupt:
+                pass
+        else:
+            runner.run(args.output)
+    elif args.action == 'compile':
+        import compiled
+        loader = load_template(args.path)
+        output = args.output or '%s-%s.inception' % (loader.name,
+                                                     loader.version_str)
+        compiled.compile_package(loader, output)
     elif args.action == 'add':
+        import downloader
         fm = downloader.FileManager()
         fm.save(args.path)
+    elif args.action == 'list':
+        import downloader
+        for metadata in downloader.FileManager().list_templates():
+            print('%(name)s %(version)s' % metadata,
+                  metadata.get('description', ''))
+    elif args.action == 'gc':
+        import downloader
+        downloader.FileManager().gc()
+    elif args.action == 'serve':
+        import server
+        server.serve(args.port, args.socket, args.cache_size,
+                     args.output_root)
+    elif args.action == 'batch':
+        import batch
+        if args.answers is None:
+            parser.error('batch action requires --answers')
+        results = batch.apply_batch(args.path, args.answers, args.output,
+                                    args.parallel)
+        if not all(x.ok for x in results):
+            parser.exit(1)
 
 if __name__ == '__main__':
     main()
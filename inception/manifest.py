@@ -0,0 +1,83 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import json
+import hashlib
+import logging
+
+LOGGER = logging.getLogger('inception.' + __name__)
+
+
+class Manifest(object):
+    """Files generated in an output directory.
+
+    For each file (relative to the output) it stores the template file it
+    comes from, a hash of the inputs used to render it and a hash of the
+    content written, so a new apply knows which files are outdated and
+    which ones were modified by the user.
+    """
+    FILENAME = '.inception-manifest.json'
+
+    def __init__(self, output):
+        self.path = os.path.join(output, self.FILENAME)
+        self.template = None
+        self.variables = {}
+        self.files = {}
+        if os.path.exists(self.path):
+            self.load()
+
+    def load(self):
+        with open(self.path) as fd:
+            data = json.load(fd)
+        self.template = data.get('template')
+        self.variables = data.get('variables', {})
+        self.files = data.get('files', {})
+
+    def save(self):
+        LOGGER.debug('Saving manifest %s', self.path)
+        data = dict(
+            template=self.template,
+            variables=self.variables,
+            files=self.files,
+        )
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fd:
+            json.dump(data, fd, indent=1, sort_keys=True, default=str)
+        os.rename(tmp, self.path)
+
+    def get(self, relative):
+        return self.files.get(relative)
+
+    def add(self, relative, source, inputs, digest):
+        self.files[relative] = dict(source=source, inputs=inputs, hash=digest)
+
+
+def inputs_hash(source_hash, variables=None):
+    """Hash of everything used to generate a file: its source and, for
+    templates, the variables."""
+    digest = hashlib.sha1(source_hash.encode('ascii'))
+    if variables is not None:
+        digest.update(json.dumps(variables, sort_keys=True,
+                                 default=str).encode('utf-8'))
+    return digest.hexdigest()
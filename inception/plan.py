@@ -0,0 +1,75 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import json
+import collections
+
+
+class Plan(object):
+    """What applying a template would do to an output directory.
+
+    Each output path gets an action: 'create' when it does not exist,
+    'update' when it was generated and would be written again, 'skip' when
+    it exists and would be kept, or 'conflict' when it exists but was not
+    generated by inception, or when two template files would write it.
+    """
+    def __init__(self, output):
+        self.output = output
+        self.files = collections.OrderedDict()
+        self.commands = []
+
+    def __contains__(self, path):
+        return path in self.files
+
+    def add(self, path, action, source, **kwargs):
+        entry = dict(path=path, action=action, source=source, **kwargs)
+        if path in self.files and action == 'conflict':
+            self.files[path].update(action=action, reason=kwargs.get(
+                'reason'))
+        else:
+            self.files[path] = entry
+
+    def command(self, command, action='not run'):
+        self.commands.append(dict(command=command, action=action))
+
+    def summary(self):
+        """Number of paths and bytes of each action."""
+        summary = {}
+        for entry in self.files.values():
+            totals = summary.setdefault(entry['action'],
+                                        dict(count=0, size=0))
+            totals['count'] += 1
+            totals['size'] += entry.get('size') or 0
+        return summary
+
+    def to_dict(self):
+        return dict(
+            output=self.output,
+            files=list(self.files.values()),
+            commands=self.commands,
+            summary=self.summary(),
+        )
+
+    def dump(self, stream):
+        json.dump(self.to_dict(), stream, indent=1, sort_keys=True)
+        stream.write('\n')
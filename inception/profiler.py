@@ -0,0 +1,137 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import defaultdict
+
+LOGGER = logging.getLogger('inception.' + __name__)
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+class Span(object):
+    def __init__(self, profiler, name, category, args):
+        self._profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def set(self, **kwargs):
+        self.args.update(kwargs)
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._profiler.add(self.name, self.category, self.start,
+                           clock() - self.start, self.args)
+
+
+class NullSpan(object):
+    """Span used while the profiler is disabled: it does nothing."""
+    def set(self, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Profiler(object):
+    """Collects timing spans and stores them in Chrome trace format, so they
+    can be loaded in chrome://tracing or Perfetto.
+
+    While disabled, `span` returns a shared object that does nothing, so
+    spans are cheap enough to be left everywhere.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._origin = clock()
+        self._events = []
+
+    def enable(self):
+        self.enabled = True
+        self._origin = clock()
+        del self._events[:]
+
+    def span(self, name, category='custom', **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args)
+
+    def add(self, name, category, start, duration, args=None):
+        self._events.append((name, category, start, duration,
+                             threading.current_thread().ident, args or {}))
+
+    def write(self, path):
+        pid = os.getpid()
+        events = [dict(name=name, cat=category, ph='X', pid=pid, tid=tid,
+                       ts=(start - self._origin) * 1e6, dur=duration * 1e6,
+                       args=args)
+                  for name, category, start, duration, tid, args
+                  in self._events]
+        with open(path, 'w') as fd:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), fd,
+                      default=str)
+
+    def slowest(self, categories, limit=10):
+        """Names with the highest total time in `categories`, as a list of
+        (seconds, name)."""
+        totals = defaultdict(float)
+        for name, category, _, duration, _, _ in self._events:
+            if category in categories:
+                totals[name] += duration
+        ranking = sorted(((v, k) for k, v in totals.items()), reverse=True)
+        return ranking[:limit]
+
+    def summary(self, limit=10):
+        lines = []
+        for title, categories in (('commands', ('command', )),
+                                  ('files', ('render', 'write'))):
+            lines.append('Slowest %s:' % title)
+            for seconds, name in self.slowest(categories, limit):
+                lines.append('  %9.3fms  %s' % (seconds * 1e3, name))
+        return '\n'.join(lines)
+
+
+PROFILER = Profiler()
+
+
+def span(name, category='custom', **args):
+    """Measures a block of code when profiling is enabled::
+
+        with span('my step', path=path):
+            do_something()
+    """
+    return PROFILER.span(name, category, **args)
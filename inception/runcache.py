@@ -0,0 +1,128 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import json
+import hashlib
+import logging
+import tarfile
+
+import fileutils
+
+LOGGER = logging.getLogger('inception.' + __name__)
+
+
+class RunCache(object):
+    """Snapshots of the files produced by `run` promises.
+
+    Each snapshot is an uncompressed tar file named by the hash of
+    everything that can change what a command produces. The cache keeps up
+    to `size` bytes, removing the least recently used snapshots first.
+    """
+    DIRECTORY = os.path.join(os.environ['HOME'], '.inception', 'cache', 'run')
+    SIZE = 1024 * 1024 * 1024
+
+    def __init__(self, directory=DIRECTORY, size=SIZE):
+        self.directory = directory
+        self.size = size
+
+    def key(self, command, variables=None, inputs=(), output='.',
+            template=None):
+        """Hash of the command, the `template` (name and version), the
+        `variables` and the content of the `inputs` files or directories,
+        relative to `output`."""
+        digest = hashlib.sha1(command.encode('utf-8'))
+        digest.update(json.dumps([template, variables], sort_keys=True,
+                                 default=str).encode('utf-8'))
+        for name in inputs:
+            for path in self._files(os.path.join(output, name)):
+                relative = os.path.relpath(path, output).replace(os.sep, '/')
+                digest.update(relative.encode('utf-8') + b'\0')
+                if os.path.exists(path):
+                    digest.update(fileutils.hash_file(path).encode('ascii'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.tar')
+
+    def restore(self, key, output):
+        """Extracts the snapshot into `output`. Returns whether there was
+        one."""
+        path = self.path(key)
+        try:
+            archive = tarfile.open(path)
+        except (IOError, OSError, tarfile.TarError):
+            return False
+        with archive:
+            LOGGER.debug('restoring %s into %s', path, output)
+            if hasattr(tarfile, 'data_filter'):
+                archive.extractall(output, filter='tar')
+            else:
+                archive.extractall(output)
+        os.utime(path, None)
+        return True
+
+    def store(self, key, output, outputs):
+        """Stores `outputs`, relative to `output`, as the snapshot of
+        `key`."""
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        path = self.path(key)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with tarfile.open(tmp, 'w') as archive:
+            for name in outputs:
+                source = os.path.join(output, name)
+                if not os.path.lexists(source):
+                    LOGGER.warning('Output "%s" was not produced', name)
+                    continue
+                archive.add(source, os.path.normpath(name))
+        os.rename(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used snapshots until the cache fits
+        in its size."""
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tar'):
+                stat = os.stat(os.path.join(self.directory, name))
+                snapshots.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in snapshots)
+        for _, size, name in sorted(snapshots):
+            if total <= self.size:
+                break
+            LOGGER.debug('evicting snapshot %s', name)
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def _files(self, path):
+        if not os.path.isdir(path):
+            yield path
+            return
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                yield os.path.join(root, name)
+
+
+RUN_CACHE = RunCache()
@@ -0,0 +1,241 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import sys
+import logging
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from commands import DEFAULT_PROGRAM, Promise
+from profiler import PROFILER
+from plan import Plan
+from archive import ArchiveWriter, is_archive
+from variables import current_context, use_context
+
+LOGGER = logging.getLogger('inception.' + __name__)
+
+
+def call_promise(command, context, *args):
+    """Calls `command` with the render `context`: as an argument for the
+    builtin promises, or as the context in use for the others, which read
+    it through `Variables` and `Options`."""
+    if isinstance(command, Promise):
+        return command(*args, context=context)
+    with use_context(context):
+        return command(*args)
+
+
+class Runner(object):
+    """Runs the program of a template.
+
+    Promises run one after the other unless the settings give more than one
+    `WORKERS`, in which case they are run by a `Scheduler`. Answers and
+    options are taken from the given `RenderContext`, or from the one in
+    use.
+    """
+    def __init__(self, loader):
+        self._loader = loader
+
+    def run(self, output, context=None):
+        context = context or current_context()
+        program = (self._loader.settings.get('PROGRAM')
+                   or DEFAULT_PROGRAM)
+        if is_archive(output):
+            # checked before the archive is created
+            program = self._archive_program(program, context)
+            with ArchiveWriter(output) as writer:
+                return self._write_archive(program, writer, context)
+        workers = self._loader.settings.get('WORKERS') or 1
+        if workers > 1:
+            return Scheduler(self._loader, output, workers,
+                             context).run(program)
+
+        for command in program:
+            LOGGER.debug('New program command: %s', command)
+            if callable(command):
+                with PROFILER.span(repr(command), 'command'):
+                    call_promise(command, context, self._loader, output)
+                continue
+            else:
+                LOGGER.error('Unsupported command: %s', command)
+
+    def archive(self, writer, context=None):
+        """Runs the program writing its files with the `writer`
+        `ArchiveWriter`.
+
+        Only promises able to write into an archive (copy and prompt) are
+        supported. Others, like run, are an error unless the `skip_run`
+        option is set, in which case they are skipped.
+        """
+        context = context or current_context()
+        program = self._archive_program(
+            self._loader.settings.get('PROGRAM') or DEFAULT_PROGRAM, context)
+        self._write_archive(program, writer, context)
+
+    def _write_archive(self, program, writer, context):
+        for command in program:
+            with PROFILER.span(repr(command), 'command'):
+                command.archive(self._loader, writer, context=context)
+
+    def _archive_program(self, program, context):
+        unsupported = [x for x in program if not hasattr(x, 'archive')]
+        if unsupported and not context.options.get('skip_run'):
+            raise ValueError(
+                'Cannot write into an archive with %s; use --skip-run to '
+                'skip them' % ', '.join(repr(x) for x in unsupported))
+        for command in unsupported:
+            LOGGER.warning('Skipping %r', command)
+        return [x for x in program if x not in unsupported]
+
+    def plan(self, output, context=None):
+        """What running the program would do in `output`, as a `Plan`.
+        Promises of the template itself are not run."""
+        context = context or current_context()
+        plan = Plan(output)
+        program = (self._loader.settings.get('PROGRAM')
+                   or DEFAULT_PROGRAM)
+        for command in program:
+            if hasattr(command, 'plan'):
+                command.plan(self._loader, output, plan, context=context)
+            else:
+                plan.command(repr(command))
+        return plan
+
+
+class Scheduler(object):
+    """Runs the promises of a program concurrently, as soon as those they
+    come `after` are done, with up to `workers` at the same time.
+
+    The output of `run` promises is written with their name as prefix. When
+    a promise fails no more promises are started, running commands are
+    terminated and the error is raised once the others finish.
+    """
+    def __init__(self, loader, output, workers, context=None,
+                 stream=sys.stdout):
+        self._loader = loader
+        self._output = output
+        self._workers = workers
+        self._context = context or current_context()
+        self._stream = stream
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    def run(self, program):
+        program = list(program)
+        dependencies = self.dependencies(program)
+        pending = set(range(len(program)))
+        running = set()
+        done = set()
+        finished = queue.Queue()
+        failure = None
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(self._workers)
+        try:
+            while running or (pending and failure is None):
+                if failure is None:
+                    for index in sorted(pending):
+                        if dependencies[index] <= done:
+                            pending.remove(index)
+                            running.add(index)
+                            pool.apply_async(self._execute, (
+                                index, program[index], finished))
+                index, error = finished.get()
+                running.remove(index)
+                done.add(index)
+                if error is not None and failure is None:
+                    failure = error
+                    self._cancelled.set()
+        finally:
+            pool.close()
+            pool.join()
+        if failure is not None:
+            if pending:
+                LOGGER.warning('%d promises were not run', len(pending))
+            raise failure
+
+    def dependencies(self, program):
+        """Indexes of the promises each promise waits for."""
+        stages = {}
+        for index, command in enumerate(program):
+            name = getattr(command, 'name', None)
+            if name is not None:
+                stages.setdefault(name, set()).add(index)
+        dependencies = []
+        for index, command in enumerate(program):
+            after = getattr(command, 'after', None)
+            if after is None:
+                dependencies.append(set([index - 1]) if index else set())
+                continue
+            waits = set()
+            for name in after:
+                if name not in stages:
+                    raise ValueError('Unknown promise "%s" in after of %r'
+                                     % (name, command))
+                waits.update(stages[name])
+            waits.discard(index)
+            dependencies.append(waits)
+        self._check_cycles(program, dependencies)
+        return dependencies
+
+    def _check_cycles(self, program, dependencies):
+        done = set()
+        while len(done) < len(program):
+            ready = [i for i in range(len(program))
+                     if i not in done and dependencies[i] <= done]
+            if not ready:
+                raise ValueError('Circular dependencies between %s' % (
+                    ', '.join(repr(program[i]) for i in range(len(program))
+                              if i not in done)))
+            done.update(ready)
+
+    def _execute(self, index, command, finished):
+        error = None
+        try:
+            LOGGER.debug('New program command: %s', command)
+            if not callable(command):
+                LOGGER.error('Unsupported command: %s', command)
+            elif not self._cancelled.is_set():
+                with PROFILER.span(repr(command), 'command'):
+                    self._call(command)
+        except Exception as e:
+            if not self._cancelled.is_set():
+                LOGGER.error('%r failed: %s', command, e)
+            error = e
+        finished.put((index, error))
+
+    def _call(self, command):
+        if not hasattr(command, 'stream'):
+            return call_promise(command, self._context, self._loader,
+                                self._output)
+        prefix = getattr(command, 'name', None) or repr(command)
+        command.stream(self._loader, self._output,
+                       lambda line: self._write(prefix, line),
+                       self._cancelled, context=self._context)
+
+    def _write(self, prefix, line):
+        with self._lock:
+            self._stream.write('[%s] %s\n' % (prefix, line))
+            self._stream.flush()
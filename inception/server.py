@@ -0,0 +1,269 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+import collections
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn, UnixStreamServer
+
+from loader import get_loader
+from runner import Runner
+from archive import ArchiveWriter
+from variables import Options, RenderContext
+import downloader
+
+LOGGER = logging.getLogger('inception.' + __name__)
+SPOOL_SIZE = 16 * 1024 * 1024
+
+
+class LoaderCache(object):
+    """Loaders with their settings already executed, by template, keeping
+    up to `size` of the most recently used ones. Compiled jinja templates
+    are kept by the `TemplateCache` of the commands.
+
+    Evicted loaders are not closed, as requests in flight may still use
+    them: their archives are closed once they are garbage collected.
+    """
+    def __init__(self, size=32):
+        self._size = size
+        self._loaders = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, template, version=None):
+        """Returns (loader, whether it was cached)."""
+        key = self.key(template, version)
+        with self._lock:
+            loader = self._loaders.pop(key, None)
+        hit = loader is not None
+        if not hit:
+            if os.path.exists(key[0]):
+                loader = get_loader(key[0])
+            else:
+                loader = downloader.FileManager().load(*key)
+            loader.settings
+        with self._lock:
+            self._loaders[key] = loader
+            while len(self._loaders) > self._size:
+                self._loaders.popitem(last=False)
+        return loader, hit
+
+    def key(self, template, version=None):
+        if os.path.exists(template):
+            return (os.path.abspath(template), None)
+        if version is None:
+            return downloader.FileManager().resolve(template)
+        return (template, version)
+
+
+class Timings(object):
+    """Time spent in each step of a request, in milliseconds."""
+    def __init__(self):
+        self.start = self.last = time.time()
+        self.steps = collections.OrderedDict()
+
+    def step(self, name):
+        now = time.time()
+        self.steps[name] = round((now - self.last) * 1000, 3)
+        self.last = now
+
+    def total(self):
+        return round((time.time() - self.start) * 1000, 3)
+
+    def header(self):
+        """Value of a Server-Timing header."""
+        return ', '.join('%s;dur=%s' % x for x in self.steps.items())
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    """Handles POST /render requests, with a JSON body like::
+
+        {"template": "name>=1.0", "answers": {...}, "output": "path"}
+
+    `template` is a path or the name (or requirement) of a stored template,
+    optionally with a `version`. With `output` the project is written there
+    and the reply is JSON; otherwise the reply is the project as a tar
+    stream. The time spent in each step is given in the Server-Timing
+    header and, for JSON replies, in `timings`.
+
+    Requests must be sent as application/json, and to a localhost Host
+    when served on a port, so that web pages cannot make browsers send
+    them. `output` must be inside the output root of the server, and is
+    relative to it.
+    """
+    server_version = 'inception'
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/render':
+            return self._reply_json(404, dict(error='Not found'))
+        content_type = self.headers.get('Content-Type') or ''
+        if content_type.split(';')[0].strip().lower() != 'application/json':
+            return self._reply_json(415, dict(
+                error='Content-Type must be application/json'))
+        hosts = self.server.allowed_hosts
+        if hosts is not None and self.headers.get('Host') not in hosts:
+            return self._reply_json(403, dict(error='Forbidden Host'))
+        timings = Timings()
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            template = request['template']
+        except (ValueError, KeyError) as e:
+            return self._reply_json(400, dict(error='Bad request: %s' % e))
+        output = request.get('output')
+        if output:
+            output = output_path(self.server.output_root, output)
+            if output is None:
+                return self._reply_json(403, dict(
+                    error='Output outside of the output root'))
+        try:
+            loader, hit = self.server.loaders.get(template,
+                                                  request.get('version'))
+            timings.step('load')
+            context = RenderContext(request.get('answers'),
+                                    dict(self.server.options,
+                                         interactive=False))
+            if output:
+                Runner(loader).run(output, context)
+                timings.step('render')
+                return self._reply_json(200, dict(
+                    output=output, cached=hit,
+                    timings=dict(timings.steps, total=timings.total())),
+                    timings)
+            with tempfile.SpooledTemporaryFile(SPOOL_SIZE) as body:
+                with ArchiveWriter('-', body) as writer:
+                    Runner(loader).archive(writer, context)
+                timings.step('render')
+                self._reply_file(body, timings)
+        except downloader.DownloaderException as e:
+            return self._reply_json(404, dict(
+                error='Template not found: %s' % e))
+        except ValueError as e:
+            return self._reply_json(400, dict(error=str(e)))
+        except Exception as e:
+            LOGGER.exception('Cannot render %s', template)
+            return self._reply_json(500, dict(
+                error='%s: %s' % (type(e).__name__, e)))
+        finally:
+            LOGGER.info('%s rendered in %sms (%s)', template,
+                        timings.total(), timings.header())
+
+    def _reply_json(self, status, data, timings=None):
+        body = json.dumps(data, sort_keys=True).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if timings is not None:
+            self.send_header('Server-Timing', timings.header())
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply_file(self, body, timings):
+        size = body.tell()
+        body.seek(0)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-tar')
+        self.send_header('Content-Length', str(size))
+        self.send_header('Server-Timing', timings.header())
+        self.end_headers()
+        while True:
+            chunk = body.read(64 * 1024)
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+
+    def log_message(self, format, *args):
+        LOGGER.debug('%s %s', self.address_string(), format % args)
+
+
+def output_path(root, output):
+    """Absolute path of `output`, relative to `root`, or None if it is not
+    inside `root` (or there is no `root`)."""
+    if not root:
+        return None
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, output))
+    if path != root and not path.startswith(os.path.join(root, '')):
+        return None
+    return path
+
+
+class RenderServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, loaders=None, options=None,
+                 output_root=None):
+        HTTPServer.__init__(self, address, RenderHandler)
+        self.loaders = loaders or LoaderCache()
+        self.options = options or {}
+        self.output_root = output_root
+        self.allowed_hosts = ['%s:%d' % (x, self.server_port)
+                              for x in ('127.0.0.1', 'localhost')]
+
+
+class UnixRenderServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+    # only local processes allowed to open the socket can connect
+    allowed_hosts = None
+
+    def __init__(self, path, loaders=None, options=None, output_root=None):
+        if os.path.exists(path):
+            os.remove(path)
+        UnixStreamServer.__init__(self, path, RenderHandler)
+        self.loaders = loaders or LoaderCache()
+        self.options = options or {}
+        self.output_root = output_root
+
+    def get_request(self):
+        # clients of unix sockets have no address
+        request, _ = self.socket.accept()
+        return request, ('local', 0)
+
+
+def serve(port=8765, unix_socket=None, cache_size=32, output_root=None):
+    """Serves render requests on localhost `port` or on `unix_socket`
+    until interrupted. Projects are written only inside `output_root`."""
+    loaders = LoaderCache(cache_size)
+    options = dict(Options())
+    if unix_socket:
+        server = UnixRenderServer(unix_socket, loaders, options, output_root)
+        LOGGER.info('Serving on %s', unix_socket)
+    else:
+        server = RenderServer(('127.0.0.1', port), loaders, options,
+                              output_root)
+        LOGGER.info('Serving on http://127.0.0.1:%d', server.server_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
@@ -13,14 +13,93 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import threading
+from contextlib import contextmanager
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
 
 class Variables(dict):
-    _instance = None
+    """Answers of the current render context.
+
+    Kept for promises written before `RenderContext`: ``Variables()`` is
+    the `variables` dict of the context in use.
+    """
+    def __new__(cls, *args, **kwargs):
+        return current_context().variables
 
-    def __new__(cls, **kwargs):
-        if cls._instance is None:
-            cls._instance = super(Variables, cls).__new__(cls, **kwargs)
-        return cls._instance
+    def __init__(self, *args, **kwargs):
+        pass
 
     def reset(self):
         self.clear()
+
+
+class Options(dict):
+    """Options given in the command line, for the commands to use them as
+    defaults. Like `Variables`, ``Options()`` is the `options` dict of the
+    context in use."""
+    def __new__(cls, *args, **kwargs):
+        return current_context().options
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class RenderContext(object):
+    """Answers (`variables`) and `options` of one apply.
+
+    `Runner.run` passes it to each promise, so many applies can run at the
+    same time in one process, in threads or in async tasks.
+    """
+    def __init__(self, variables=None, options=None):
+        self.variables = dict.__new__(Variables)
+        self.variables.update(variables or {})
+        self.options = dict.__new__(Options)
+        self.options.update(options or {})
+
+    def copy(self):
+        return RenderContext(self.variables, self.options)
+
+
+class _LocalVar(object):
+    """Fallback of contextvars.ContextVar, by thread."""
+    def __init__(self, name, default=None):
+        self._local = threading.local()
+        self._default = default
+
+    def get(self):
+        return getattr(self._local, 'value', self._default)
+
+    def set(self, value):
+        token = self.get()
+        self._local.value = value
+        return token
+
+    def reset(self, token):
+        self._local.value = token
+
+
+if contextvars is not None:
+    _CURRENT = contextvars.ContextVar('inception_context', default=None)
+else:
+    _CURRENT = _LocalVar('inception_context')
+
+DEFAULT_CONTEXT = RenderContext()
+
+
+def current_context():
+    """Context in use, or the process default one."""
+    return _CURRENT.get() or DEFAULT_CONTEXT
+
+
+@contextmanager
+def use_context(context):
+    """Makes `context` the one in use inside the with block."""
+    token = _CURRENT.set(context)
+    try:
+        yield context
+    finally:
+        _CURRENT.reset(token)
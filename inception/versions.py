@@ -0,0 +1,160 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import re
+import json
+import bisect
+import logging
+
+LOGGER = logging.getLogger('inception.' + __name__)
+
+OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '>=': lambda a, b: a >= b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '<': lambda a, b: a < b,
+}
+
+
+def version_key(version):
+    """Sorting key for version strings.
+
+    Numbers are compared as numbers ("10" goes after "9"), trailing zeros do
+    not matter ("1.0" == "1") and pre-releases go before the release, both
+    semantic version ones ("1.0.0-beta" < "1.0.0") and those without a
+    hyphen ("1.0rc1" < "1.0"). Build metadata ("+build") does not count.
+    """
+    release, _, pre = version.strip().split('+', 1)[0].partition('-')
+    parts = release.split('.')
+    numbers = []
+    for index, part in enumerate(parts):
+        number, suffix = re.match(r'(\d*)(.*)', part).groups()
+        numbers.append(int(number or 0))
+        if suffix:
+            # pre-releases written without a hyphen, like "1.0rc1"
+            rest = parts[index + 1:] + ([pre] if pre else [])
+            pre = '.'.join([suffix] + rest)
+            break
+    while numbers and numbers[-1] == 0:
+        numbers.pop()
+    if not pre:
+        return tuple(numbers), (1, )
+    return tuple(numbers), (0, ) + _identifiers_key(pre)
+
+
+def _identifiers_key(pre):
+    """Key of a pre-release, like "rc.1": numbers go before words, and are
+    compared as numbers ("rc10" goes after "rc9")."""
+    key = []
+    for identifier in pre.split('.'):
+        for chunk in re.findall(r'\d+|\D+', identifier):
+            if chunk.isdigit():
+                key.append((0, int(chunk), ''))
+            else:
+                key.append((1, 0, chunk))
+    return tuple(key)
+
+
+class Requirement(object):
+    """A template name with optional version constraints, like
+    ``name>=1.2,<2``."""
+    def __init__(self, spec):
+        match = re.match(r'^\s*([^<>=!\s]+)\s*(.*)$', spec)
+        if match is None:
+            raise ValueError('Invalid requirement: %s' % spec)
+        self.name, constraints = match.groups()
+        self.constraints = []
+        for constraint in constraints.split(','):
+            if not constraint.strip():
+                continue
+            match = re.match(r'^\s*(==|!=|>=|<=|>|<)\s*(\S+)\s*$',
+                             constraint)
+            if match is None:
+                raise ValueError('Invalid constraint: %s' % constraint)
+            operator, version = match.groups()
+            self.constraints.append((operator, version_key(version)))
+
+    def matches(self, version):
+        key = version_key(version)
+        return all(OPERATORS[op](key, other)
+                   for op, other in self.constraints)
+
+    def __repr__(self):
+        return 'Requirement(%r)' % self.name
+
+
+class VersionIndex(object):
+    """Sorted versions of a template, stored in `path` as JSON so the latest
+    one is known without listing the repository."""
+    def __init__(self, path):
+        self.path = path
+        self._versions = None
+
+    @property
+    def versions(self):
+        if self._versions is None:
+            self._versions = self._read()
+        return self._versions
+
+    @property
+    def latest(self):
+        return self.versions[-1] if self.versions else None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def add(self, version):
+        versions = self.versions
+        if version in versions:
+            return
+        keys = [version_key(x) for x in versions]
+        versions.insert(bisect.bisect(keys, version_key(version)), version)
+        self.save()
+
+    def rebuild(self, versions):
+        self._versions = sorted(versions, key=version_key)
+        self.save()
+
+    def resolve(self, requirement):
+        """Newest version matching `requirement`, or None."""
+        if not requirement.constraints:
+            return self.latest
+        for version in reversed(self.versions):
+            if requirement.matches(version):
+                return version
+        return None
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fd:
+            json.dump(dict(versions=self.versions, latest=self.latest), fd)
+        os.rename(tmp, self.path)
+
+    def _read(self):
+        if not self.exists():
+            return []
+        with open(self.path) as fd:
+            return json.load(fd).get('versions', [])
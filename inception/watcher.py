@@ -0,0 +1,155 @@
+# The MIT License (MIT)
+#
+# Copyright (C) 2014 Miguel Angel Garcia <miguelangel.garcia@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os
+import time
+import logging
+
+from commands import DEFAULT_PROGRAM, CallCopy, CallPrompt
+from runner import Runner
+from variables import current_context
+
+LOGGER = logging.getLogger('inception.' + __name__)
+
+
+class Watcher(object):
+    """Applies a template directory and keeps the output up to date while
+    it is edited.
+
+    The directory is polled every `interval` seconds comparing the size and
+    mtime of its files. Edited files are written again by the copy promises
+    they belong to, with the answers of the first apply, so the work done
+    follows the size of the edit. `settings.py` is executed again only when
+    it changes, and then the prompt and copy promises of its program are
+    run as an update. Hidden files and directories are ignored.
+    """
+    SETTINGS = 'settings.py'
+
+    def __init__(self, loader, output, context=None, interval=0.5):
+        self._loader = loader
+        self._output = output
+        self._context = context or current_context()
+        self._interval = interval
+        self._stamps = {}
+        self._failed = {}
+
+    def run(self):
+        self.start()
+        LOGGER.info('Watching %s for changes', self._loader.path)
+        while True:
+            time.sleep(self._interval)
+            self.poll()
+
+    def start(self):
+        """First apply. Later ones keep its answers and update generated
+        files."""
+        self._context.options['update'] = True
+        self._stamps = self.stamps()
+        Runner(self._loader).run(self._output, self._context)
+        self._context.options['interactive'] = False
+
+    def poll(self):
+        """Applies the changes since the previous poll. Returns the paths,
+        relative to the template, that changed.
+
+        Errors, like a half written template, are logged and watching goes
+        on. The paths that failed keep their previous stamp, so they are
+        tried again with the next edit.
+        """
+        stamps = self.stamps()
+        changed = sorted(x for x in set(stamps) | set(self._stamps)
+                         if x not in stamps or x not in self._stamps
+                         or stamps[x] != self._stamps[x])
+        edited = [x for x in changed
+                  if x not in self._failed or self._failed[x] != stamps.get(x)]
+        if not edited:
+            return []
+        LOGGER.info('Changed: %s', ', '.join(edited))
+        failed = set(self._apply(changed))
+        for path in changed:
+            if path in failed:
+                self._failed[path] = stamps.get(path)
+                continue
+            self._failed.pop(path, None)
+            if path in stamps:
+                self._stamps[path] = stamps[path]
+            else:
+                del self._stamps[path]
+        return changed
+
+    def _apply(self, changed):
+        """Writes the `changed` paths. Returns those that failed."""
+        if self.SETTINGS in changed:
+            try:
+                self._loader.load_settings()
+                self._reapply()
+            except Exception as e:
+                LOGGER.error('Cannot apply %s: %s', self.SETTINGS, e)
+                LOGGER.debug('Error applying %s', self.SETTINGS,
+                             exc_info=True)
+                return changed
+            return []
+        failed = []
+        for command in self._copies():
+            prefix = os.path.normpath(command.source) + os.sep
+            paths = [x[len(prefix):] for x in changed if x.startswith(prefix)]
+            if paths:
+                failed.extend(prefix + x for x in command.refresh(
+                    self._loader, self._output, paths, self._context))
+        return failed
+
+    def stamps(self):
+        """(size, mtime) of each file of the template, and None for each
+        directory, by path relative to it."""
+        stamps = {}
+        basepathlen = len(os.path.normpath(self._loader.path)) + 1
+        for root, dirs, files in os.walk(self._loader.path):
+            dirs[:] = [x for x in dirs if not x.startswith('.')]
+            for name in dirs:
+                stamps[os.path.join(root, name)[basepathlen:]] = None
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                origin = os.path.join(root, name)
+                try:
+                    stat = os.stat(origin)
+                except OSError:
+                    # removed while walking, seen by the next poll
+                    continue
+                stamps[origin[basepathlen:]] = (stat.st_size, stat.st_mtime)
+        return stamps
+
+    def _program(self):
+        return self._loader.settings.get('PROGRAM') or DEFAULT_PROGRAM
+
+    def _copies(self):
+        return [x for x in self._program() if isinstance(x, CallCopy)]
+
+    def _reapply(self):
+        """Runs the prompt and copy promises again. Run commands and custom
+        promises only run on the first apply."""
+        for command in self._program():
+            if isinstance(command, (CallCopy, CallPrompt)):
+                command(self._loader, self._output, self._context)
+            else:
+                LOGGER.info('Skipping %r', command)
@@ -0,0 +1,89 @@
+import os
+import sys
+import logging
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'inception'))
+
+import commands  # noqa
+import downloader  # noqa
+import loader  # noqa
+from runcache import RunCache  # noqa
+
+
+class TemplateTestCase(unittest.TestCase):
+    """Test with a template directory, `self.template`, with an empty
+    `files` directory, and an output path, `self.output`, inside a temporary
+    directory removed after each test.
+
+    The caches and the template repository in ~/.inception are moved into
+    the temporary directory as well.
+    """
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.template = os.path.join(self.tmp, 'template')
+        self.output = os.path.join(self.tmp, 'output')
+        os.makedirs(os.path.join(self.template, 'files'))
+        self.home = os.path.join(self.tmp, 'home')
+        isolate_caches(self, self.home)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, content, base=None):
+        """Writes `content`, text or bytes, into the `name` file of the
+        template, or of the `base` directory."""
+        mode = 'wb' if isinstance(content, bytes) else 'w'
+        with open(os.path.join(base or self.template, name), mode) as fd:
+            fd.write(content)
+
+    def settings(self, program):
+        self.write('settings.py', program + '\n')
+
+    def read(self, *path):
+        """Content of a file of the output."""
+        with open(os.path.join(self.output, *path)) as fd:
+            return fd.read()
+
+
+def isolate_caches(test, home):
+    """Moves the caches and the template repository into `home` until the
+    end of `test`."""
+    cache = os.path.join(home, 'cache')
+    patch(test, loader, 'CODE_CACHE', os.path.join(cache, 'code'))
+    patch(test, loader.TemplateIndex, 'DIRECTORY',
+          os.path.join(cache, 'index'))
+    patch(test, commands, 'RUN_CACHE',
+          RunCache(os.path.join(cache, 'run')))
+    patch(test, commands.TEMPLATES, '_directory',
+          os.path.join(cache, 'jinja'))
+    # created again, with its bytecode cache in the new directory
+    patch(test, commands.TEMPLATES, '_environment', None)
+    patch(test, downloader.FileManager, 'REPO_PATH',
+          os.path.join(home, 'repository'))
+    patch(test, downloader.FileManager, 'BLOBS_PATH',
+          os.path.join(home, 'blobs'))
+
+
+def patch(test, target, name, value):
+    """Sets the `name` attribute of `target` to `value` until the end of
+    `test`."""
+    test.addCleanup(setattr, target, name, getattr(target, name))
+    setattr(target, name, value)
+
+
+class Warnings(logging.Handler):
+    """Keeps the warnings logged by inception, in `messages`, until the end
+    of `test`."""
+    def __init__(self, test):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.messages = []
+        logger = logging.getLogger('inception')
+        logger.addHandler(self)
+        test.addCleanup(logger.removeHandler, self)
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
@@ -0,0 +1,90 @@
+import io
+import os
+import sys
+import stat
+import tarfile
+import zipfile
+
+from helpers import TemplateTestCase, Warnings, patch
+from archive import is_archive
+from loader import PathLoader
+from runner import Runner
+from variables import Options, Variables
+
+
+class TestArchiveOutput(TemplateTestCase):
+    def setUp(self):
+        super(TestArchiveOutput, self).setUp()
+        os.makedirs(os.path.join(self.template, 'files', 'bin'))
+        self.write('files/{{ name }}.txt.jinja', 'hi {{ name }}')
+        self.write('files/bin/run.sh', '#!/bin/sh\n')
+        os.chmod(os.path.join(self.template, 'files', 'bin', 'run.sh'),
+                 0o755)
+        self.settings('PROGRAM = [copy()]')
+        Variables().reset()
+        Variables()['name'] = 'example'
+
+    def tearDown(self):
+        Variables().reset()
+        Options().pop('skip_run', None)
+        super(TestArchiveOutput, self).tearDown()
+
+    def apply(self, name):
+        output = os.path.join(self.tmp, name)
+        Runner(PathLoader(self.template)).run(output)
+        return output
+
+    def test_is_archive(self):
+        assert is_archive('project.tar.gz')
+        assert is_archive('project.zip')
+        assert is_archive('-')
+        assert not is_archive('project')
+
+    def test_tar(self):
+        with tarfile.open(self.apply('project.tar.gz')) as archive:
+            assert b'hi example' == archive.extractfile(
+                'example.txt').read()
+            assert archive.getmember('bin').isdir()
+            assert 0o755 == archive.getmember('bin/run.sh').mode
+        assert ['home', 'project.tar.gz', 'template'] == sorted(
+            os.listdir(self.tmp))
+
+    def test_zip(self):
+        with zipfile.ZipFile(self.apply('project.zip')) as archive:
+            assert b'hi example' == archive.read('example.txt')
+            mode = archive.getinfo('bin/run.sh').external_attr >> 16
+            assert 0o755 == stat.S_IMODE(mode)
+
+    def test_run_is_rejected(self):
+        self.settings('PROGRAM = [copy(), run("touch ran")]')
+        with self.assertRaises(ValueError):
+            self.apply('project.tar')
+        assert not os.path.exists(os.path.join(self.tmp, 'project.tar'))
+
+    def test_run_is_skipped(self):
+        self.settings('PROGRAM = [copy(), run("touch ran")]')
+        Options()['skip_run'] = True
+        warnings = Warnings(self)
+        with tarfile.open(self.apply('project.tar')) as archive:
+            assert 'ran' not in archive.getnames()
+        assert ["Skipping run('touch ran')"] == warnings.messages
+
+    def test_prompts_stay_out_of_the_stream(self):
+        self.settings('QUESTIONS = [{"kind": "text", "name": "name", '
+                      '"message": "Name"}]')
+        import inquirer
+
+        def prompt(questions):
+            print('[?] Name: typed')
+            return dict(name='typed')
+
+        patch(self, inquirer, 'prompt', prompt)
+        stdout = io.TextIOWrapper(io.BytesIO(), write_through=True)
+        patch(self, sys, 'stdout', stdout)
+        patch(self, sys, 'stderr', io.StringIO())
+        Runner(PathLoader(self.template)).run('-')
+        stream = io.BytesIO(stdout.buffer.getvalue())
+        with tarfile.open(fileobj=stream, mode='r|') as archive:
+            assert ['bin', 'bin/run.sh', 'typed.txt'] == sorted(
+                x.name for x in archive)
+        assert '[?] Name: typed' in sys.stderr.getvalue()
@@ -0,0 +1,87 @@
+import os
+import json
+
+from helpers import TemplateTestCase
+from batch import apply_batch
+from downloader import FileManager
+from variables import Options
+
+
+class TestBatch(TemplateTestCase):
+    def setUp(self):
+        super(TestBatch, self).setUp()
+        self.write('metadata.py', 'name = "example"\nversion = "0.9"\n')
+        self.write('settings.py', 'QUESTIONS = [\n'
+                   '    {"kind": "text", "name": "name", "message": "Name"},\n'
+                   '    {"kind": "text", "name": "kind", "message": "Kind",'
+                   ' "default": "lib"},\n'
+                   ']\n')
+        self.write('files/{{ name }}.txt.jinja', '{{ name }} {{ kind }}')
+        self.answers = os.path.join(self.tmp, 'answers.jsonl')
+        self.addCleanup(Options().pop, 'interactive', None)
+
+    def records(self, *records):
+        with open(self.answers, 'w') as fd:
+            for record in records:
+                fd.write(json.dumps(record) + '\n')
+            # blank lines are skipped
+            fd.write('\n')
+
+    def test_answers(self):
+        self.records(dict(output='one', answers=dict(name='one', kind='app')),
+                     dict(output='two', answers=dict(name='two')))
+        results = apply_batch(self.template, self.answers, self.output)
+        assert [True, True] == [x.ok for x in results]
+        assert [1, 2] == [x.line for x in results]
+        assert 'one app' == self.read('one', 'one.txt')
+        # questions without an answer take their default
+        assert 'two lib' == self.read('two', 'two.txt')
+
+    def test_failures_are_reported(self):
+        self.records(dict(output='one', answers=dict(kind='app')),
+                     dict(answers=dict(name='two')),
+                     dict(output='three', answers=dict(name='three')))
+        results = apply_batch(self.template, self.answers, self.output)
+        assert [False, False, True] == [x.ok for x in results]
+        assert 'No answer for question "name"' in results[0].error
+        assert 'No output given' in results[1].error
+        assert 'three lib' == self.read('three', 'three.txt')
+
+    def test_malformed_lines_fail_alone(self):
+        self.records(dict(output='one', answers=dict(name='one')))
+        with open(self.answers, 'a') as fd:
+            fd.write('{"output": "two", \n["not", "a", "record"]\n')
+            fd.write(json.dumps(dict(output='three',
+                                     answers=dict(name='three'))) + '\n')
+        results = apply_batch(self.template, self.answers, self.output)
+        assert [1, 3, 4, 5] == [x.line for x in results]
+        assert [True, False, False, True] == [x.ok for x in results]
+        assert 'JSONDecodeError' in results[1].error or \
+            'ValueError' in results[1].error
+        assert 'not a JSON object' in results[2].error
+        assert 'three lib' == self.read('three', 'three.txt')
+
+    def test_outputs(self):
+        absolute = os.path.join(self.tmp, 'absolute')
+        self.records(dict(output='relative', answers=dict(name='one')),
+                     dict(output=absolute, answers=dict(name='two')))
+        results = apply_batch(self.template, self.answers, self.output)
+        assert [os.path.join(self.output, 'relative'), absolute] == \
+            [x.output for x in results]
+        assert os.path.exists(os.path.join(absolute, 'two.txt'))
+
+    def test_parallel(self):
+        names = ['project%d' % i for i in range(6)]
+        self.records(*[dict(output=x, answers=dict(name=x)) for x in names])
+        results = apply_batch(self.template, self.answers, self.output,
+                              parallel=3)
+        assert all(x.ok for x in results)
+        for name in names:
+            assert '%s lib' % name == self.read(name, name + '.txt')
+
+    def test_stored_template(self):
+        FileManager().save(self.template)
+        self.records(dict(output='one', answers=dict(name='one')))
+        results = apply_batch('example<0.10', self.answers, self.output)
+        assert results[0].ok
+        assert 'one lib' == self.read('one', 'one.txt')
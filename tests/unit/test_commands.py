@@ -0,0 +1,44 @@
+import os
+
+from helpers import TemplateTestCase, Warnings
+from commands import TemplateCache
+
+
+class TestTemplateCache(TemplateTestCase):
+    def setUp(self):
+        super(TestTemplateCache, self).setUp()
+        self.directory = os.path.join(self.tmp, 'jinja')
+
+    def test_bounded(self):
+        cache = TemplateCache(size=2, directory=None)
+        for source in ('a{{ x }}', 'b{{ x }}', 'c{{ x }}'):
+            cache.get(source)
+        assert [cache.key('b{{ x }}'), cache.key('c{{ x }}')] == list(
+            cache._templates)
+        # the most recently used one is kept
+        cache.get('b{{ x }}')
+        cache.get('d{{ x }}')
+        assert [cache.key('b{{ x }}'), cache.key('d{{ x }}')] == list(
+            cache._templates)
+        assert 'd1' == cache.get('d{{ x }}').render(x=1)
+
+    def test_bytecode_reused(self):
+        TemplateCache(directory=self.directory).get('hi {{ name }}')
+        assert 1 == len(os.listdir(self.directory))
+        cache = TemplateCache(directory=self.directory)
+        cache.environment.compile = self.fail
+        assert 'hi you' == cache.get('hi {{ name }}').render(name='you')
+
+    def test_disabled(self):
+        cache = TemplateCache(directory=None)
+        assert cache.environment.bytecode_cache is None
+        assert 'hi you' == cache.get('hi {{ name }}').render(name='you')
+
+        # a directory that cannot be created disables it too
+        warnings = Warnings(self)
+        self.write('jinja', 'a file', self.tmp)
+        cache = TemplateCache(directory=os.path.join(self.directory, 'sub'))
+        assert cache.environment.bytecode_cache is None
+        assert 'hi you' == cache.get('hi {{ name }}').render(name='you')
+        assert 1 == len(warnings.messages)
+        assert 'Template cache disabled' in warnings.messages[0]
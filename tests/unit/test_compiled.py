@@ -0,0 +1,67 @@
+import os
+
+from helpers import TemplateTestCase
+import commands
+from compiled import compile_package
+from loader import CompiledLoader, PathLoader, get_loader
+from runner import Runner
+from variables import Variables
+
+
+class TestCompiledPackage(TemplateTestCase):
+    def setUp(self):
+        super(TestCompiledPackage, self).setUp()
+        os.makedirs(os.path.join(self.template, 'files', 'bin'))
+        self.write('settings.py', 'PROGRAM = [copy()]\n')
+        self.write('metadata.py', 'name = "example"\nversion = "1.0"\n')
+        self.write('files/{{ name }}.txt.jinja', 'hi {{ name }}')
+        self.write('files/bin/run.sh', '#!/bin/sh\n')
+        os.chmod(os.path.join(self.template, 'files', 'bin', 'run.sh'),
+                 0o755)
+        self.package = os.path.join(self.tmp, 'example.inception')
+        compile_package(PathLoader(self.template), self.package)
+        Variables().reset()
+        Variables()['name'] = 'example'
+
+    def tearDown(self):
+        Variables().reset()
+        super(TestCompiledPackage, self).tearDown()
+
+    def test_recognized(self):
+        loader = get_loader(self.package)
+        assert isinstance(loader, CompiledLoader)
+        assert 'example' == loader.name
+        assert '1.0' == loader.version_str
+
+    def test_walk(self):
+        loader = get_loader(self.package)
+        names = [x.relative_path for x in loader.walk('files')]
+        assert ['bin', '{{ name }}.txt.jinja', 'bin/run.sh'] == names
+
+    def test_apply_without_compiling(self):
+        loader = get_loader(self.package)
+        templates = commands.TEMPLATES
+        templates._templates.clear()
+        # file names are still rendered
+        templates.get('{{ name }}.txt')
+        templates._compile = self.fail
+        try:
+            Runner(loader).run(self.output)
+        finally:
+            del templates._compile
+        assert 'hi example' == self.read('example.txt')
+        assert 0o755 == os.stat(
+            os.path.join(self.output, 'bin', 'run.sh')).st_mode & 0o777
+
+    def test_code_needs_the_same_versions(self):
+        loader = get_loader(self.package)
+        entry = [x for x in loader.header['files']
+                 if x['path'].endswith('.jinja')][0]
+        settings = loader.header['code']['settings.py']
+        assert loader.code(entry) is not None
+        loader.header['jinja'] = '0.0-other'
+        loader._codes.clear()
+        assert loader.code(entry) is None
+        assert loader._load_code(settings, 'settings.py') is not None
+        loader.header['python'] = 'other'
+        assert loader._load_code(settings, 'settings.py') is None
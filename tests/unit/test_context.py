@@ -0,0 +1,65 @@
+import os
+from multiprocessing.pool import ThreadPool
+
+from helpers import TemplateTestCase
+from loader import PathLoader
+from runner import Runner
+from variables import (Options, RenderContext, Variables,
+                       current_context, use_context)
+
+
+QUESTIONS = '''QUESTIONS = [
+    {"kind": "text", "name": "name", "message": "Name"},
+    {"kind": "text", "name": "kind", "message": "Kind", "default": "lib"},
+]
+'''
+
+
+class TestRenderContext(TemplateTestCase):
+    def setUp(self):
+        super(TestRenderContext, self).setUp()
+        self.write('settings.py', QUESTIONS)
+        self.write('files/{{ name }}.txt.jinja', '{{ name }} {{ kind }}')
+        self.write('files/static.txt.jinja', '{{ name }}')
+
+    def test_concurrent_applies(self):
+        loader = PathLoader(self.template)
+        names = ['project%d' % i for i in range(16)]
+
+        def apply(name):
+            context = RenderContext(dict(name=name),
+                                    dict(interactive=False, jobs=2))
+            Runner(loader).run(os.path.join(self.output, name), context)
+            return context
+
+        pool = ThreadPool(8)
+        try:
+            contexts = pool.map(apply, names)
+        finally:
+            pool.close()
+            pool.join()
+        for name, context in zip(names, contexts):
+            assert dict(name=name, kind='lib') == context.variables
+            assert '%s lib' % name == self.read(name, name + '.txt')
+            assert name == self.read(name, 'static.txt')
+        assert 'name' not in Variables()
+
+    def test_old_promises_see_the_context(self):
+        seen = []
+
+        def promise(loader, output):
+            seen.append((dict(Variables()), Options().get('interactive')))
+
+        self.settings('PROGRAM = []')
+        loader = PathLoader(self.template)
+        loader.settings['PROGRAM'] = [promise]
+        context = RenderContext(dict(name='old'), dict(interactive=False))
+        Runner(loader).run(self.tmp, context)
+        assert [(dict(name='old'), False)] == seen
+
+    def test_use_context(self):
+        context = RenderContext(dict(name='inner'))
+        with use_context(context):
+            assert context is current_context()
+            assert 'inner' == Variables()['name']
+        assert context is not current_context()
@@ -0,0 +1,56 @@
+import os
+
+from helpers import TemplateTestCase, Warnings
+from commands import CallCopy
+from loader import PathLoader
+from manifest import Manifest
+from variables import RenderContext
+
+
+class TestParallelCopy(TemplateTestCase):
+    def setUp(self):
+        super(TestParallelCopy, self).setUp()
+        for directory in ('bin', 'docs/deep'):
+            os.makedirs(os.path.join(self.template, 'files', directory))
+        for index in range(20):
+            self.write('files/docs/page%d.txt.jinja' % index,
+                       '{{ name }} page %d\n' % index)
+            self.write('files/docs/deep/static%d.txt' % index,
+                       'static %d\n' % index)
+        self.write('files/{{ name }}.txt.jinja', 'hi {{ name }}')
+        self.write('files/logo.png.jinja', b'\x89PNG\0{{ name }}')
+        self.write('files/bin/run.sh', '#!/bin/sh\n')
+        os.chmod(os.path.join(self.template, 'files', 'bin', 'run.sh'),
+                 0o755)
+        self.warnings = Warnings(self)
+
+    def apply(self, name, **kwargs):
+        """Applies the template into `name`, where a file already exists.
+        Returns its files, manifest and warnings."""
+        output = os.path.join(self.tmp, name)
+        os.makedirs(output)
+        self.write('existing.txt', 'mine', output)
+        self.write('files/existing.txt', 'template')
+        self.warnings.messages = []
+        CallCopy(**kwargs)(PathLoader(self.template), output,
+                           RenderContext(dict(name='example')))
+        files = {}
+        for root, dirs, names in os.walk(output):
+            for filename in names:
+                path = os.path.join(root, filename)
+                with open(path, 'rb') as fd:
+                    files[os.path.relpath(path, output)] = (
+                        fd.read(), os.stat(path).st_mode)
+        warnings = sorted(x.replace(output, 'OUTPUT')
+                          for x in self.warnings.messages)
+        return files, Manifest(output).files, warnings
+
+    def test_same_as_serial(self):
+        serial = self.apply('serial')
+        files, manifest, warnings = serial
+        assert b'hi example' == files['example.txt'][0]
+        assert b'\x89PNG\0{{ name }}' == files['logo.png'][0]
+        assert b'mine' == files['existing.txt'][0]
+        assert 2 == len(warnings)
+        assert serial == self.apply('threads', jobs=4)
+        assert serial == self.apply('processes', jobs=2, pool='process')
@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'inception'))
+
+import downloader  # noqa
+
+
+INDEX = [
+    dict(name='python-package', version='1.0', url='http://x/pp-1.0.zip',
+         description='A Python package with setup.py'),
+    dict(name='python-package', version='1.1', url='http://x/pp-1.1.zip',
+         description='A Python package with setup.py'),
+    dict(name='python-cli', version='0.1', url='http://x/cli.zip',
+         description='Command line tool'),
+    dict(name='django-site', version='2.0', url='http://x/django.zip',
+         description='Django web site in Python'),
+]
+
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = downloader.Database(os.path.join(self.tmp, 'catalog'))
+        self.db.import_index(json.dumps(INDEX))
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmp)
+
+    def test_get_last_version(self):
+        assert 'http://x/pp-1.1.zip' == self.db.get('python-package')
+
+    def test_get_newest_version(self):
+        for version in ('1.10', '1.9', '1.10-rc1'):
+            self.db.insert('ordered', 'http://x/%s.zip' % version, version)
+        assert 'http://x/1.10.zip' == self.db.get('ordered')
+        self.db.insert('ordered', 'http://y/1.9.zip', '1.9')
+        assert 'http://x/1.10.zip' == self.db.get('ordered')
+
+    def test_get_version(self):
+        assert 'http://x/pp-1.0.zip' == self.db.get('python-package', '1.0')
+
+    def test_get_missing(self):
+        with self.assertRaises(KeyError):
+            self.db.get('missing')
+
+    def test_insert_replaces(self):
+        self.db.insert('python-cli', 'http://y/cli.zip', '0.1')
+        assert 'http://y/cli.zip' == self.db.get('python-cli')
+        assert 1 == len(self.db.list('python-cli'))
+
+    def test_prefix(self):
+        names = [x['name'] for x in self.db.list('python-')]
+        assert ['python-cli', 'python-package', 'python-package'] == names
+
+    def test_keywords(self):
+        found = set(x['name'] for x in self.db.search('pyth'))
+        assert set(['python-cli', 'python-package', 'django-site']) == found
+        found = set(x['name'] for x in self.db.search('python web'))
+        assert set(['django-site']) == found
+
+    def test_import_simple_index(self):
+        self.db.import_index('{"simple": "http://x/simple.zip"}')
+        assert 'http://x/simple.zip' == self.db.get('simple')
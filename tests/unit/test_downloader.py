@@ -0,0 +1,189 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'inception'))
+
+from helpers import TemplateTestCase  # noqa
+import downloader  # noqa
+
+
+FILES = {
+    '/package.zip': b'zip content' * 1000,
+    '/index.json': b'{"example": "http://example/package.zip"}',
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        if self.path == '/moved':
+            self.send_response(302)
+            self.send_header('Location', '/index.json')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        content = FILES.get(self.path)
+        if content is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = '"%d"' % hash(content)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.server.transfers += 1
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    connections = 0
+    transfers = 0
+
+
+class TestDownloader(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.cache = tempfile.mkdtemp()
+        self.downloader = downloader.Downloader(cache=self.cache)
+
+    def tearDown(self):
+        self.downloader.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache)
+
+    def test_fetch_file(self):
+        content = self.downloader.fetch_file(self.url + '/index.json')
+        assert FILES['/index.json'] == content
+
+    def test_connection_is_reused(self):
+        for _ in range(3):
+            self.downloader.fetch_file(self.url + '/index.json')
+        assert 1 == self.server.connections
+
+    def test_redirects_are_followed(self):
+        content = self.downloader.fetch_file(self.url + '/moved')
+        assert FILES['/index.json'] == content
+
+    def test_missing_file(self):
+        with self.assertRaises(downloader.DownloadError):
+            self.downloader.fetch_file(self.url + '/missing')
+
+    def test_download_is_streamed_to_disk(self):
+        target = self.downloader.download(self.url + '/package.zip')
+        assert target.startswith(self.cache)
+        with open(target, 'rb') as fd:
+            assert FILES['/package.zip'] == fd.read()
+
+    def test_unchanged_download_is_not_transferred_again(self):
+        first = self.downloader.download(self.url + '/package.zip')
+        second = self.downloader.download(self.url + '/package.zip')
+        assert first == second
+        assert 1 == self.server.transfers
+
+    def test_download_many(self):
+        urls = [self.url + x for x in sorted(FILES)]
+        targets = self.downloader.download_many(urls)
+        for path, target in zip(sorted(FILES), targets):
+            with open(target, 'rb') as fd:
+                assert FILES[path] == fd.read()
+
+
+class TestFileManager(TemplateTestCase):
+    def setUp(self):
+        super(TestFileManager, self).setUp()
+        os.makedirs(os.path.join(self.template, 'files', 'bin'))
+        self.write('settings.py', 'PROGRAM = [copy()]\n')
+        self.write('files/bin/run.sh', '#!/bin/sh\n')
+        os.chmod(os.path.join(self.template, 'files', 'bin', 'run.sh'),
+                 0o755)
+        self.manager = downloader.FileManager()
+
+    def save(self, version, text):
+        self.write('metadata.py', 'name = "t"\nversion = "%s"\n' % version)
+        self.write('files/a.txt', text)
+        self.manager.save(self.template)
+
+    def tree(self, version):
+        tree = self.manager._tree(os.path.join(
+            self.manager.REPO_PATH, 't', version))
+        return dict((x['path'], x) for x in tree['entries'])
+
+    def blobs(self):
+        return sorted(self.manager.blobs.digests())
+
+    def test_versions_share_blobs(self):
+        self.save('1.0', 'one')
+        assert 4 == len(self.blobs())
+        self.save('1.1', 'two')
+        # only the changed metadata.py and a.txt are stored again
+        assert 6 == len(self.blobs())
+        old, new = self.tree('1.0'), self.tree('1.1')
+        for path in ('settings.py', 'files/bin/run.sh'):
+            assert old[path]['hash'] == new[path]['hash']
+        for path in ('metadata.py', 'files/a.txt'):
+            assert old[path]['hash'] != new[path]['hash']
+
+    def test_load_materializes_permissions(self):
+        self.write('files/copy.sh', '#!/bin/sh\n')
+        os.chmod(os.path.join(self.template, 'files', 'copy.sh'), 0o700)
+        self.save('1.0', 'one')
+        path = self.manager.load('t', '1.0').path
+        blob = self.manager.blobs.blob_path(
+            self.tree('1.0')['files/bin/run.sh']['hash'])
+        modes = {os.path.join(path, 'files', 'bin', 'run.sh'): 0o755,
+                 os.path.join(path, 'files', 'copy.sh'): 0o700}
+        for target, mode in modes.items():
+            assert mode == os.stat(target).st_mode & 0o777
+            with open(target) as fd:
+                assert '#!/bin/sh\n' == fd.read()
+            # the blob has the permissions of the first file stored: that
+            # one is linked to it, the other one is a copy
+            assert (mode == os.stat(blob).st_mode & 0o777) == (
+                os.path.samefile(blob, target))
+        assert path == self.manager.load('t', '1.0').path
+
+    def test_gc_removes_unused_blobs(self):
+        self.save('1.0', 'one')
+        assert (0, 0) == self.manager.gc()
+        self.save('1.1', 'two')
+        shutil.rmtree(os.path.join(self.manager.REPO_PATH, 't', '1.0'))
+        os.remove(os.path.join(self.manager.REPO_PATH, 't',
+                               self.manager.INDEX_FILE))
+        count, size = self.manager.gc()
+        assert 2 == count
+        assert sorted(x['hash'] for x in self.tree('1.1').values()
+                      if x['type'] == 'file') == self.blobs()
+        loader = self.manager.load('t', '1.1')
+        with open(os.path.join(loader.path, 'files', 'a.txt')) as fd:
+            assert 'two' == fd.read()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from helpers import TemplateTestCase
+import fileutils
+from commands import CallCopy
+from loader import PathLoader
+from variables import RenderContext
+
+
+class TestWriteChunks(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.target = os.path.join(self.tmp, 'target')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_content_and_digest(self):
+        chunks = [u'caf\xe9 %d\n' % i for i in range(100000)]
+        digest = fileutils.write_chunks(self.target, chunks, 0o600)
+        with open(self.target, 'rb') as fd:
+            content = fd.read()
+        assert u''.join(chunks).encode('utf-8') == content
+        assert hashlib.sha1(content).hexdigest() == digest
+        assert 0o600 == os.stat(self.target).st_mode & 0o777
+
+    def test_interrupted(self):
+        def chunks():
+            yield u'partial'
+            raise KeyboardInterrupt()
+
+        with self.assertRaises(KeyboardInterrupt):
+            fileutils.write_chunks(self.target, chunks())
+        assert [] == os.listdir(self.tmp)
+
+
+@unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+class TestStreamingRender(TemplateTestCase):
+    def setUp(self):
+        super(TestStreamingRender, self).setUp()
+        self.write('files/big.sql.jinja',
+                   '{% for i in range(400000) %}'
+                   'INSERT INTO t VALUES ({{ i }}, "{{ name }}");\n'
+                   '{% endfor %}')
+
+    def test_memory_is_bounded(self):
+        tracemalloc.start()
+        try:
+            CallCopy()(PathLoader(self.template), self.output,
+                       RenderContext(dict(name='example')))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        size = os.path.getsize(os.path.join(self.output, 'big.sql'))
+        assert size > 15 * 1024 * 1024
+        assert peak < size / 2
@@ -0,0 +1,126 @@
+import os
+import zipfile
+
+from helpers import TemplateTestCase, patch
+import loader
+
+
+class TestBinaryDetection(TemplateTestCase):
+    def setUp(self):
+        super(TestBinaryDetection, self).setUp()
+
+    def write(self, name, content):
+        super(TestBinaryDetection, self).write(os.path.join('files', name),
+                                               content)
+
+    def contents(self, template_loader, source='files'):
+        return dict((x.relative_path, x)
+                    for x in template_loader.walk(source) if x.is_file)
+
+    def test_sniffing(self):
+        assert loader.is_binary_data(b'a\0b')
+        assert loader.is_binary_data(b'\xff\xfe')
+        assert not loader.is_binary_data(u'caf\xe9'.encode('utf-8'))
+        # a multibyte character cut by the end of the chunk
+        assert not loader.is_binary_data(u'\xe9'.encode('utf-8')[:1])
+
+    def test_extension_of_templates(self):
+        self.write('logo.png.jinja', b'{{ name }}')
+        self.write('readme.txt.jinja', b'\0')
+        contents = self.contents(loader.PathLoader(self.template))
+        assert contents['logo.png.jinja'].is_binary
+        assert not contents['readme.txt.jinja'].is_binary
+
+    def test_content_is_bytes(self):
+        self.write('data.jinja', b'\xff{{ name }}')
+        contents = self.contents(loader.PathLoader(self.template))
+        assert b'\xff{{ name }}' == contents['data.jinja'].content
+        assert contents['data.jinja'].is_binary
+
+    def test_index_is_stored(self):
+        self.write('data.jinja', b'\0')
+        template_loader = loader.PathLoader(self.template)
+        assert self.contents(template_loader)['data.jinja'].is_binary
+        template_loader.template_index.save()
+
+        index = loader.TemplateIndex(self.template)
+        assert index.entries[os.path.join('files', 'data.jinja')]['binary']
+        # the entry is computed again when the file changes
+        self.write('data.jinja', b'text')
+        os.utime(os.path.join(self.template, 'files', 'data.jinja'),
+                 (0, 0))
+        assert not self.contents(loader.PathLoader(self.template))[
+            'data.jinja'].is_binary
+
+    def test_index_by_path_in_the_template(self):
+        os.makedirs(os.path.join(self.template, 'other'))
+        # with the same stamp
+        self.write('data', b'text')
+        super(TestBinaryDetection, self).write(os.path.join('other', 'data'),
+                                               b'\0\0\0\0')
+        for directory in ('files', 'other'):
+            os.utime(os.path.join(self.template, directory, 'data'), (0, 0))
+        template_loader = loader.PathLoader(self.template)
+        assert not self.contents(template_loader)['data'].is_binary
+        assert self.contents(template_loader, 'other')['data'].is_binary
+        template_loader.template_index.save()
+        template_loader = loader.PathLoader(self.template)
+        assert self.contents(template_loader, 'other')['data'].is_binary
+        assert not self.contents(template_loader)['data'].is_binary
+
+
+class TestCompilePython(TemplateTestCase):
+    def test_cached_by_filename(self):
+        first = loader.compile_python('A = 1\n', '/first/settings.py')
+        second = loader.compile_python('A = 1\n', '/second/settings.py')
+        assert '/first/settings.py' == first.co_filename
+        assert '/second/settings.py' == second.co_filename
+        assert 2 == len(os.listdir(loader.CODE_CACHE))
+        again = loader.compile_python('A = 1\n', '/second/settings.py')
+        assert '/second/settings.py' == again.co_filename
+        assert 2 == len(os.listdir(loader.CODE_CACHE))
+
+
+class TestZipLoader(TemplateTestCase):
+    def setUp(self):
+        super(TestZipLoader, self).setUp()
+        self.stored = b'stored {{ name }}\n' * 100
+        self.deflated = bytes(bytearray(range(256))) * 100
+        self.path = os.path.join(self.tmp, 'template.zip')
+        # a stub before the archive, like self-extracting ones have
+        with open(self.path, 'wb') as fd:
+            fd.write(b'#!/bin/sh\nexit 0\n')
+        with zipfile.ZipFile(self.path, 'a') as archive:
+            archive.writestr('template/settings.py', 'PROGRAM = []\n')
+            archive.writestr('template/files/a.txt.jinja', self.stored,
+                             zipfile.ZIP_STORED)
+            archive.writestr('template/files/sub/b.bin', self.deflated,
+                             zipfile.ZIP_DEFLATED)
+            archive.writestr('template/files_other/c.txt', 'c')
+        self.loader = loader.get_loader(self.path)
+        self.addCleanup(self.loader.close)
+
+    def contents(self):
+        return dict((x.relative_path, x)
+                    for x in self.loader.walk('template/files'))
+
+    def test_walk_prefixed(self):
+        contents = self.contents()
+        assert ['a.txt.jinja', 'sub', 'sub/b.bin'] == sorted(contents)
+        assert contents['sub'].is_dir
+        assert self.stored == contents['a.txt.jinja'].content
+        assert [] == list(self.loader.walk('template/missing'))
+
+    def test_copy_stored(self):
+        target = os.path.join(self.tmp, 'a.txt')
+        # copied from its range in the archive, without zipfile
+        patch(self, zipfile.ZipFile, 'open', self.fail)
+        self.contents()['a.txt.jinja'].copy_to(target)
+        with open(target, 'rb') as fd:
+            assert self.stored == fd.read()
+
+    def test_copy_deflated(self):
+        target = os.path.join(self.tmp, 'b.bin')
+        self.contents()['sub/b.bin'].copy_to(target)
+        with open(target, 'rb') as fd:
+            assert self.deflated == fd.read()
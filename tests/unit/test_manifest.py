@@ -0,0 +1,86 @@
+import os
+
+from helpers import TemplateTestCase, Warnings
+from commands import CallCopy
+from loader import PathLoader
+from manifest import Manifest
+from variables import RenderContext
+import fileutils
+
+
+class TestUpdate(TemplateTestCase):
+    def setUp(self):
+        super(TestUpdate, self).setUp()
+        self.write('files/{{ name }}.txt.jinja', 'hi {{ name }}')
+        self.write('files/static.txt', 'static')
+        self.warnings = Warnings(self)
+
+    def apply(self, update=False, **answers):
+        answers.setdefault('name', 'example')
+        CallCopy()(PathLoader(self.template), self.output,
+                   RenderContext(answers, dict(update=update)))
+
+    def test_manifest(self):
+        self.apply()
+        manifest = Manifest(self.output)
+        assert self.template == manifest.template
+        assert dict(name='example') == manifest.variables
+        assert ['example.txt', 'static.txt'] == sorted(manifest.files)
+        entry = manifest.get('example.txt')
+        assert '{{ name }}.txt.jinja' == entry['source']
+        assert fileutils.hash_text('hi example') == entry['hash']
+        assert entry['inputs']
+
+    def test_outdated_files_are_rewritten(self):
+        self.apply()
+        self.write('files/static.txt', 'changed')
+        self.apply(update=True)
+        assert 'changed' == self.read('static.txt')
+        assert 'hi example' == self.read('example.txt')
+        entry = Manifest(self.output).get('static.txt')
+        assert fileutils.hash_text('changed') == entry['hash']
+        assert [] == self.warnings.messages
+
+    def test_modified_files_are_kept(self):
+        self.apply()
+        self.write('static.txt', 'mine', self.output)
+        self.write('files/static.txt', 'changed')
+        self.apply(update=True)
+        assert 'mine' == self.read('static.txt')
+        assert ['File "%s" was modified and will not be updated.' %
+                os.path.join(self.output, 'static.txt')] == \
+            self.warnings.messages
+
+    def test_existing_files_are_kept(self):
+        os.makedirs(self.output)
+        self.write('static.txt', 'mine', self.output)
+        self.apply()
+        self.write('files/static.txt', 'changed')
+        self.apply(update=True)
+        assert 'mine' == self.read('static.txt')
+        message = 'File "%s" already exists and will not be overriden.' % (
+            os.path.join(self.output, 'static.txt'))
+        assert [message, message] == self.warnings.messages
+
+    def test_apply_again_warns(self):
+        self.apply()
+        self.apply()
+        assert 2 == len(self.warnings.messages)
+        assert all('already exists' in x for x in self.warnings.messages)
+
+    def test_files_written_twice_warn(self):
+        self.write('files/{{ name }}.jinja', 'other')
+        self.apply(name='static.txt')
+        # the first one walked is written
+        assert self.read('static.txt') in ('static', 'other')
+        assert 1 == len(self.warnings.messages)
+        assert 'written by another file' in self.warnings.messages[0]
+
+    def test_failed_update_keeps_the_output(self):
+        self.apply()
+        self.write('files/{{ name }}.txt.jinja', 'partial{{ 1 // 0 }}')
+        with self.assertRaises(ZeroDivisionError):
+            self.apply(update=True)
+        assert 'hi example' == self.read('example.txt')
+        assert ['example.txt', 'static.txt'] == sorted(
+            x for x in os.listdir(self.output) if x != Manifest.FILENAME)
@@ -0,0 +1,94 @@
+import io
+import os
+import sys
+import json
+
+from helpers import TemplateTestCase, patch
+from commands import CallCopy, CallPrompt, CallRun
+from loader import PathLoader
+from manifest import Manifest
+from plan import Plan
+from variables import Options, Variables
+
+
+class TestPlan(TemplateTestCase):
+    def setUp(self):
+        super(TestPlan, self).setUp()
+        os.makedirs(os.path.join(self.template, 'files', 'docs'))
+        os.makedirs(self.output)
+        self.write('files/{{ name }}.txt.jinja', 'hi {{ name }}')
+        self.write('files/docs/readme.txt', 'readme')
+        self.write('files/setup.py', 'setup')
+        Variables().reset()
+        Variables()['name'] = 'example'
+
+    def tearDown(self):
+        Variables().reset()
+        super(TestPlan, self).tearDown()
+
+    def plan(self):
+        plan = Plan(self.output)
+        loader = PathLoader(self.template)
+        CallCopy().plan(loader, self.output, plan)
+        CallRun('make').plan(loader, self.output, plan)
+        return plan
+
+    def test_actions(self):
+        self.write('example.txt', 'mine', self.output)
+        self.write('setup.py', 'generated', self.output)
+        manifest = Manifest(self.output)
+        manifest.add('setup.py', 'setup.py', 'inputs', 'hash')
+        manifest.save()
+
+        plan = self.plan()
+        actions = dict((k, v['action']) for k, v in plan.files.items())
+        assert 'conflict' == actions['example.txt']
+        assert 'skip' == actions['setup.py']
+        assert 'create' == actions['docs']
+        assert 'create' == actions['docs/readme.txt']
+        assert [dict(command="run('make')", action='not run')] == \
+            plan.commands
+
+    def test_sizes_come_from_the_template(self):
+        summary = self.plan().summary()
+        # the docs directory and the three files
+        assert 4 == summary['create']['count']
+        assert len('hi {{ name }}readmesetup') == summary['create']['size']
+
+    def test_nothing_is_written(self):
+        self.plan()
+        assert [] == os.listdir(self.output)
+
+    def test_update(self):
+        CallCopy()(PathLoader(self.template), self.output)
+        self.write('files/setup.py', 'changed')
+        self.write('docs/readme.txt', 'mine', self.output)
+        Options()['update'] = True
+        self.addCleanup(Options().pop, 'update', None)
+        files = self.plan().files
+        assert 'update' == files['setup.py']['action']
+        assert ('skip', 'modified') == (files['docs/readme.txt']['action'],
+                                        files['docs/readme.txt']['reason'])
+        assert ('skip', 'up to date') == (files['example.txt']['action'],
+                                          files['example.txt']['reason'])
+        CallCopy()(PathLoader(self.template), self.output)
+        assert 'changed' == self.read('setup.py')
+
+    def test_prompts_stay_out_of_the_json(self):
+        import inquirer
+
+        def prompt(questions):
+            print('[?] Name: typed')
+            return dict(name='typed')
+
+        patch(self, inquirer, 'prompt', prompt)
+        patch(self, sys, 'stdout', io.StringIO())
+        patch(self, sys, 'stderr', io.StringIO())
+        plan = Plan(self.output)
+        CallPrompt(dict(kind='text', name='name', message='Name')).plan(
+            PathLoader(self.template), self.output, plan)
+        CallCopy().plan(PathLoader(self.template), self.output, plan)
+        plan.dump(sys.stdout)
+        assert 'typed.txt' in [x['path'] for x in
+                               json.loads(sys.stdout.getvalue())['files']]
+        assert '[?] Name: typed' in sys.stderr.getvalue()
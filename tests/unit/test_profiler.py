@@ -0,0 +1,60 @@
+import os
+import json
+
+from helpers import TemplateTestCase
+from loader import PathLoader
+from profiler import PROFILER, Profiler
+from runner import Runner
+from variables import RenderContext
+
+
+class TestProfiler(TemplateTestCase):
+    def test_chrome_trace(self):
+        self.settings('PROGRAM = [copy()]')
+        self.write('files/a.txt.jinja', 'hi {{ name }}')
+        self.write('files/static.txt', 'static')
+        PROFILER.enable()
+        # cleanups run last first: the events are dropped, then it is
+        # disabled
+        self.addCleanup(setattr, PROFILER, 'enabled', False)
+        self.addCleanup(PROFILER.enable)
+        Runner(PathLoader(self.template)).run(
+            self.output, RenderContext(dict(name='you')))
+        trace = os.path.join(self.tmp, 'trace.json')
+        PROFILER.write(trace)
+
+        with open(trace) as fd:
+            events = json.load(fd)['traceEvents']
+        for event in events:
+            assert 'X' == event['ph']
+            assert os.getpid() == event['pid']
+            assert isinstance(event['tid'], int)
+            assert 0 <= event['ts']
+            assert 0 <= event['dur']
+            assert isinstance(event['args'], dict)
+        names = dict((x['cat'], []) for x in events)
+        for event in events:
+            names[event['cat']].append(event['name'])
+        assert 1 == len(names['command'])
+        assert names['command'][0].startswith('copy')
+        assert [os.path.join(self.output, 'a.txt')] == names['render']
+        assert os.path.join(self.output, 'static.txt') in names['write']
+
+    def test_summary_ranks(self):
+        profiler = Profiler()
+        profiler.enable()
+        for name, category, duration in (
+                ('copy', 'command', 0.001), ('run', 'command', 0.003),
+                ('copy', 'command', 0.001), ('a.txt', 'render', 0.005),
+                ('b.txt', 'write', 0.002), ('a.txt', 'write', 0.001),
+                ('walk', 'walk', 1)):
+            profiler.add(name, category, 0, duration)
+        assert [(0.003, 'run'), (0.002, 'copy')] == profiler.slowest(
+            ('command', ))
+        assert ['Slowest commands:',
+                '      3.000ms  run',
+                '      2.000ms  copy',
+                'Slowest files:',
+                '      6.000ms  a.txt',
+                '      2.000ms  b.txt'] == profiler.summary().split('\n')
+        assert [(0.006, 'a.txt')] == profiler.slowest(('render', 'write'), 1)
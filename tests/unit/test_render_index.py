@@ -0,0 +1,54 @@
+import os
+
+from helpers import TemplateTestCase
+import loader
+from commands import CallCopy
+from compiled import compile_package
+from variables import RenderContext
+
+
+class TestRenderIndex(TemplateTestCase):
+    def setUp(self):
+        super(TestRenderIndex, self).setUp()
+        self.write('metadata.py', 'name = "example"\nversion = "1.0"\n')
+        self.write('files/{{ name }}.txt.jinja', '{{ name }}')
+        self.write('files/kind.txt.jinja',
+                   '{% if kind %}{{ kind }}{% endif %}')
+        self.write('files/static.txt.jinja', 'static')
+
+    def contents(self, template_loader):
+        return dict((x.relative_path, x)
+                    for x in template_loader.walk('files'))
+
+    def apply(self, update=False, **answers):
+        context = RenderContext(answers, dict(update=update))
+        CallCopy()(loader.PathLoader(self.template), self.output, context)
+
+    def mtime(self, name):
+        return os.stat(os.path.join(self.output, name)).st_mtime
+
+    def test_variables(self):
+        contents = self.contents(loader.PathLoader(self.template))
+        named = contents['{{ name }}.txt.jinja']
+        assert named.templated_name
+        assert ['name'] == named.body_variables
+        assert ['kind'] == contents['kind.txt.jinja'].body_variables
+        assert [] == contents['static.txt.jinja'].body_variables
+        assert not contents['static.txt.jinja'].templated_name
+
+    def test_compiled_variables(self):
+        package = os.path.join(self.tmp, 'example.inception')
+        compile_package(loader.PathLoader(self.template), package)
+        contents = self.contents(loader.get_loader(package))
+        assert ['kind'] == contents['kind.txt.jinja'].body_variables
+
+    def test_only_affected_files_are_rendered(self):
+        self.apply(name='one', kind='lib')
+        past = 1000000000
+        for name in ('one.txt', 'kind.txt', 'static.txt'):
+            os.utime(os.path.join(self.output, name), (past, past))
+        self.apply(update=True, name='one', kind='app')
+        assert past == self.mtime('one.txt')
+        assert past == self.mtime('static.txt')
+        assert past != self.mtime('kind.txt')
+        assert 'app' == self.read('kind.txt')
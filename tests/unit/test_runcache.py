@@ -0,0 +1,79 @@
+import os
+import time
+import shutil
+
+from helpers import TemplateTestCase
+import commands
+from runcache import RunCache
+from variables import Variables
+
+
+class FakeLoader(object):
+    name = 'example'
+    version_str = '1.0'
+
+
+class TestRunCache(TemplateTestCase):
+    def setUp(self):
+        super(TestRunCache, self).setUp()
+        os.makedirs(self.output)
+        Variables().reset()
+
+    def tearDown(self):
+        Variables().reset()
+        super(TestRunCache, self).tearDown()
+
+    def run_counted(self, **kwargs):
+        command = commands.CallRun(
+            'mkdir -p build; cat input > build/out; echo x >> ../runs',
+            cache=True, outputs=['build'], inputs=['input'], **kwargs)
+        command(FakeLoader(), self.output)
+
+    def runs(self):
+        with open(os.path.join(self.tmp, 'runs')) as fd:
+            return len(fd.readlines())
+
+    def test_restored_on_hit(self):
+        self.write('input', 'one', self.output)
+        self.run_counted()
+        shutil.rmtree(os.path.join(self.output, 'build'))
+        self.run_counted()
+        assert 1 == self.runs()
+        assert 'one' == self.read('build/out')
+
+    def test_inputs_change_the_key(self):
+        self.write('input', 'one', self.output)
+        self.run_counted()
+        self.write('input', 'two', self.output)
+        self.run_counted()
+        assert 2 == self.runs()
+        assert 'two' == self.read('build/out')
+
+    def test_only_given_variables_change_the_key(self):
+        self.write('input', 'one', self.output)
+        Variables()['name'] = 'a'
+        self.run_counted(variables=['name'])
+        Variables()['other'] = 'b'
+        self.run_counted(variables=['name'])
+        assert 1 == self.runs()
+        Variables()['name'] = 'b'
+        self.run_counted(variables=['name'])
+        assert 2 == self.runs()
+
+    def test_outputs_are_required(self):
+        with self.assertRaises(ValueError):
+            commands.CallRun('true', cache=True)
+
+    def test_least_recently_used_are_evicted(self):
+        cache = RunCache(os.path.join(self.tmp, 'lru'))
+        self.write('big', 'x' * 10000, self.output)
+        for key in ('a', 'b'):
+            cache.store(key, self.output, ['big'])
+        cache.size = os.path.getsize(cache.path('a')) * 2.5
+        past = time.time() - 100
+        os.utime(cache.path('a'), (past, past))
+        cache.restore('a', self.output)
+        cache.store('c', self.output, ['big'])
+        assert os.path.exists(cache.path('a'))
+        assert not os.path.exists(cache.path('b'))
+        assert os.path.exists(cache.path('c'))
@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'inception'))
+
+from commands import CallRun  # noqa
+from runner import Runner, Scheduler  # noqa
+
+
+class FakeLoader(object):
+    def __init__(self, program, workers=None):
+        self.settings = dict(PROGRAM=program, WORKERS=workers)
+
+
+class Lines(object):
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.extend(text.splitlines())
+
+    def flush(self):
+        pass
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def run_program(self, program, workers=4):
+        stream = Lines()
+        Scheduler(FakeLoader(program), self.output, workers,
+                  stream=stream).run(program)
+        return stream.lines
+
+    def read(self, name):
+        with open(os.path.join(self.output, name)) as fd:
+            return fd.read().split()
+
+    def test_independent_promises_run_concurrently(self):
+        program = [
+            CallRun('sleep 0.5', after=()),
+            CallRun('sleep 0.5', after=()),
+            CallRun('sleep 0.5', after=()),
+        ]
+        start = time.time()
+        self.run_program(program)
+        assert time.time() - start < 1.2
+
+    def test_promises_wait_for_their_stage(self):
+        program = [
+            CallRun('sleep 0.2; echo a >> log', name='first', after=()),
+            CallRun('echo b >> log', name='first', after=()),
+            CallRun('echo c >> log', after='first'),
+            CallRun('echo d >> log'),
+        ]
+        self.run_program(program)
+        log = self.read('log')
+        assert ['c', 'd'] == log[2:]
+        assert set(['a', 'b']) == set(log[:2])
+
+    def test_output_is_prefixed(self):
+        lines = self.run_program([
+            CallRun('echo hello', name='greet'),
+            CallRun('echo bye'),
+        ])
+        assert ['[greet] hello', "[run('echo bye')] bye"] == lines
+
+    def test_failure_cancels_siblings(self):
+        program = [
+            CallRun('sleep 5', after=()),
+            CallRun('sleep 0.2; false', name='fail', after=()),
+            CallRun('echo late > late', after='fail'),
+        ]
+        start = time.time()
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.run_program(program)
+        assert time.time() - start < 3
+        assert not os.path.exists(os.path.join(self.output, 'late'))
+
+    def test_unknown_stage(self):
+        with self.assertRaises(ValueError):
+            self.run_program([CallRun('true', after='nope')])
+
+    def test_circular_dependencies(self):
+        with self.assertRaises(ValueError):
+            self.run_program([
+                CallRun('true', name='a', after='b'),
+                CallRun('true', name='b', after='a'),
+            ])
+
+    def test_runner_is_sequential_by_default(self):
+        calls = []
+        program = [lambda loader, output: calls.append(1),
+                   lambda loader, output: calls.append(2)]
+        Runner(FakeLoader(program)).run(self.output)
+        assert [1, 2] == calls
@@ -0,0 +1,155 @@
+import os
+import io
+import json
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+from multiprocessing.pool import ThreadPool
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+from helpers import TemplateTestCase, isolate_caches
+from compiled import compile_package
+from loader import PathLoader
+from runner import Runner
+from server import LoaderCache, RenderServer
+
+
+class TestRenderServer(TemplateTestCase):
+    def setUp(self):
+        super(TestRenderServer, self).setUp()
+        self.write('settings.py', 'QUESTIONS = [{"kind": "text", '
+                   '"name": "name", "message": "Name"}]\n')
+        self.write('files/{{ name }}.txt.jinja', 'hi {{ name }}')
+        self.server = RenderServer(('127.0.0.1', 0), LoaderCache(2),
+                                   output_root=self.tmp)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(TestRenderServer, self).tearDown()
+
+    def render(self, headers=None, **request):
+        connection = httplib.HTTPConnection('127.0.0.1',
+                                            self.server.server_port)
+        headers = dict({'Content-Type': 'application/json'},
+                       **(headers or {}))
+        try:
+            connection.request('POST', '/render', json.dumps(request),
+                               headers)
+            response = connection.getresponse()
+            return response, response.read()
+        finally:
+            connection.close()
+
+    def test_tar_stream(self):
+        response, body = self.render(template=self.template,
+                                     answers=dict(name='one'))
+        assert 200 == response.status
+        assert 'render;dur=' in response.getheader('Server-Timing')
+        with tarfile.open(fileobj=io.BytesIO(body)) as archive:
+            assert b'hi one' == archive.extractfile('one.txt').read()
+
+    def test_output_path(self):
+        self.render(template=self.template, answers=dict(name='one'))
+        response, body = self.render(template=self.template,
+                                     output='output',
+                                     answers=dict(name='two'))
+        result = json.loads(body.decode('utf-8'))
+        assert result['cached']
+        assert 'total' in result['timings']
+        assert 'hi two' == self.read('two.txt')
+
+    def test_concurrent_requests(self):
+        names = ['project%d' % i for i in range(12)]
+
+        def render(name):
+            return self.render(template=self.template,
+                               answers=dict(name=name))[1]
+
+        pool = ThreadPool(6)
+        try:
+            bodies = pool.map(render, names)
+        finally:
+            pool.close()
+            pool.join()
+        for name, body in zip(names, bodies):
+            with tarfile.open(fileobj=io.BytesIO(body)) as archive:
+                assert ['%s.txt' % name] == archive.getnames()
+
+    def test_errors(self):
+        assert 400 == self.render(template=self.template)[0].status
+        assert 404 == self.render(template='missing-template')[0].status
+
+    def test_json_only(self):
+        response, _ = self.render(
+            headers={'Content-Type': 'text/plain'},
+            template=self.template, answers=dict(name='one'))
+        assert 415 == response.status
+        response, _ = self.render(
+            headers={'Host': 'evil.example:%d' % self.server.server_port},
+            template=self.template, answers=dict(name='one'))
+        assert 403 == response.status
+
+    def test_output_inside_the_root(self):
+        for output in ('..', '../elsewhere', '/tmp', self.output + '/../..'):
+            response, _ = self.render(template=self.template,
+                                      output=output,
+                                      answers=dict(name='one'))
+            assert 403 == response.status, output
+        assert not os.path.exists(os.path.join(self.tmp, '..', 'one.txt'))
+        self.server.output_root = None
+        response, _ = self.render(template=self.template,
+                                  output=self.output,
+                                  answers=dict(name='one'))
+        assert 403 == response.status
+        assert not os.path.exists(self.output)
+
+
+class TestLoaderCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        isolate_caches(self, os.path.join(self.tmp, 'home'))
+        for name in 'abc':
+            os.makedirs(os.path.join(self.tmp, name))
+            with open(os.path.join(self.tmp, name, 'settings.py'), 'w'):
+                pass
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_bounded(self):
+        cache = LoaderCache(2)
+        paths = [os.path.join(self.tmp, x) for x in 'abc']
+        first, hit = cache.get(paths[0])
+        assert not hit
+        assert (first, True) == cache.get(paths[0])
+        cache.get(paths[1])
+        cache.get(paths[2])
+        assert not cache.get(paths[0])[1]
+
+    def test_evicted_loaders_stay_usable(self):
+        template = os.path.join(self.tmp, 'a')
+        os.makedirs(os.path.join(template, 'files'))
+        for name, content in (('metadata.py', 'name = "a"\n'),
+                              ('settings.py', 'PROGRAM = [copy()]\n'),
+                              ('files/a.txt.jinja', 'a')):
+            with open(os.path.join(template, name), 'w') as fd:
+                fd.write(content)
+        package = os.path.join(self.tmp, 'a.inception')
+        compile_package(PathLoader(template), package)
+        cache = LoaderCache(1)
+        # a request in flight, while another one evicts its loader
+        loader, _ = cache.get(package)
+        cache.get(os.path.join(self.tmp, 'b'))
+        output = os.path.join(self.tmp, 'output')
+        Runner(loader).run(output)
+        with open(os.path.join(output, 'a.txt')) as fd:
+            assert 'a' == fd.read()
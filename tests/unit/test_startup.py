@@ -0,0 +1,36 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'benchmarks'))
+
+import startup  # noqa
+
+
+class TestStartup(unittest.TestCase):
+    def test_budget(self):
+        total, times = startup.measure(repeat=3)
+        assert [] == startup.eager(times)
+        assert total < startup.BUDGET, (
+            'startup took %.1fms, over %dms' % (total, startup.BUDGET))
+
+    def test_apply_without_templates(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            template = os.path.join(tmp, 'template')
+            os.makedirs(os.path.join(template, 'files'))
+            with open(os.path.join(template, 'settings.py'), 'w') as fd:
+                fd.write('PROGRAM = [prompt(), copy()]\n')
+            with open(os.path.join(template, 'files', 'a.txt'), 'w') as fd:
+                fd.write('{{ not rendered }}')
+            times = startup.import_times(
+                'import sys, main; sys.argv = ["inception", "apply", '
+                '"--template-path", %r, "-o", %r]; main.main()'
+                % (template, os.path.join(tmp, 'output')), home=tmp)
+            assert os.path.exists(os.path.join(tmp, 'output', 'a.txt'))
+            assert [] == startup.eager(times, ('jinja2', 'inquirer'))
+        finally:
+            shutil.rmtree(tmp)
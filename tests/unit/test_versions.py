@@ -0,0 +1,76 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'inception'))
+
+from versions import version_key, Requirement, VersionIndex  # noqa
+
+
+class TestVersionKey(unittest.TestCase):
+    def test_numbers_are_compared_as_numbers(self):
+        assert version_key('10.0') > version_key('9.1')
+
+    def test_trailing_zeros(self):
+        assert version_key('1.0.0') == version_key('1')
+
+    def test_prereleases_go_first(self):
+        assert version_key('1.0rc1') < version_key('1.0')
+        assert version_key('1.0rc1') > version_key('0.9')
+
+    def test_semantic_prereleases_go_first(self):
+        assert version_key('1.0.0-beta') < version_key('1.0.0')
+        assert version_key('1.0-rc1') < version_key('1.0')
+        assert version_key('1.0-rc1') > version_key('0.9')
+        assert version_key('1.0-rc1') == version_key('1.0rc1')
+        ordered = ['1.0.0-alpha', '1.0.0-alpha.1', '1.0.0-alpha.beta',
+                   '1.0.0-beta.2', '1.0.0-beta.11', '1.0.0-rc.1', '1.0.0']
+        assert ordered == sorted(reversed(ordered), key=version_key)
+
+    def test_build_metadata_is_ignored(self):
+        assert version_key('1.0+build.5') == version_key('1.0')
+
+
+class TestRequirement(unittest.TestCase):
+    def test_name_only(self):
+        requirement = Requirement('example')
+        assert 'example' == requirement.name
+        assert requirement.matches('0.1')
+
+    def test_range(self):
+        requirement = Requirement('example>=1.2,<2')
+        assert 'example' == requirement.name
+        assert requirement.matches('1.10')
+        assert not requirement.matches('1.1')
+        assert not requirement.matches('2.0')
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            Requirement('example=>1')
+
+
+class TestVersionIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'versions.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_add_keeps_order(self):
+        index = VersionIndex(self.path)
+        for version in ['1.2', '10.0', '9.0', '1.10']:
+            index.add(version)
+        index = VersionIndex(self.path)
+        assert ['1.2', '1.10', '9.0', '10.0'] == index.versions
+        assert '10.0' == index.latest
+
+    def test_resolve(self):
+        index = VersionIndex(self.path)
+        index.rebuild(['1.0', '1.5', '2.0'])
+        assert '1.5' == index.resolve(Requirement('x>=1.2,<2'))
+        assert '2.0' == index.resolve(Requirement('x'))
+        assert index.resolve(Requirement('x>3')) is None
@@ -0,0 +1,93 @@
+import os
+
+from helpers import TemplateTestCase
+import commands
+from loader import PathLoader
+from variables import RenderContext
+from watcher import Watcher
+
+
+class TestWatcher(TemplateTestCase):
+    def setUp(self):
+        super(TestWatcher, self).setUp()
+        self.write('settings.py', 'PROGRAM = [prompt(), copy()]\n'
+                   'QUESTIONS = [{"kind": "text", "name": "name", '
+                   '"message": "Name", "default": "default"}]\n')
+        self.write('files/{{ name }}.txt.jinja', 'hi {{ name }}')
+        self.write('files/static.txt', 'static')
+        self.loader = PathLoader(self.template)
+        self.watcher = Watcher(self.loader, self.output, RenderContext(
+            dict(name='example'), dict(interactive=False)))
+        self.watcher.start()
+
+    def write(self, name, content):
+        super(TestWatcher, self).write(name, content)
+        # edits in the same clock tick must be seen as well
+        path = os.path.join(self.template, name)
+        mtime = os.stat(path).st_mtime + 1
+        os.utime(path, (mtime, mtime))
+
+    def test_only_edited_files_are_written(self):
+        rendered = []
+        materialize = commands.CallCopy._materialize
+
+        def counted(command, task, context):
+            rendered.append(task[1].relative_path)
+            return materialize(command, task, context)
+
+        commands.CallCopy._materialize = counted
+        try:
+            assert [] == self.watcher.poll()
+            self.write('files/{{ name }}.txt.jinja', 'bye {{ name }}')
+            os.makedirs(os.path.join(self.template, 'files', 'docs'))
+            self.write('files/docs/new.txt', 'new')
+            self.watcher.poll()
+        finally:
+            commands.CallCopy._materialize = materialize
+        assert ['docs/new.txt', '{{ name }}.txt.jinja'] == rendered
+        assert 'bye example' == self.read('example.txt')
+        assert 'new' == self.read('docs/new.txt')
+
+    def test_modified_outputs_are_kept(self):
+        with open(os.path.join(self.output, 'static.txt'), 'w') as fd:
+            fd.write('mine')
+        self.write('files/static.txt', 'changed')
+        self.watcher.poll()
+        assert 'mine' == self.read('static.txt')
+
+    def test_settings_are_executed_when_changed(self):
+        settings = self.loader.settings
+        self.write('files/static.txt', 'changed')
+        self.watcher.poll()
+        assert settings is self.loader.settings
+        self.write('settings.py', 'PROGRAM = [copy(), run("touch ran")]\n')
+        self.watcher.poll()
+        assert settings is not self.loader.settings
+        assert 'changed' == self.read('static.txt')
+        assert 'hi example' == self.read('example.txt')
+        assert not os.path.exists(os.path.join(self.output, 'ran'))
+
+    def test_errors_do_not_stop_watching(self):
+        self.write('files/{{ name }}.txt.jinja', 'bye {{ name ')
+        self.write('files/static.txt', 'changed')
+        self.watcher.poll()
+        assert 'hi example' == self.read('example.txt')
+        assert 'changed' == self.read('static.txt')
+        # not tried again until something is edited
+        assert [] == self.watcher.poll()
+        self.write('files/{{ name }}.txt.jinja', 'bye {{ name }}')
+        assert ['files/{{ name }}.txt.jinja'] == self.watcher.poll()
+        assert 'bye example' == self.read('example.txt')
+
+    def test_settings_errors_do_not_stop_watching(self):
+        self.write('settings.py', 'PROGRAM = [prompt(), copy()]\n'
+                   'QUESTIONS = [{"kind": "text", "name": "kind", '
+                   '"message": "Kind"}]\n')
+        self.write('files/kind.txt.jinja', '{{ kind }}')
+        self.watcher.poll()
+        assert not os.path.exists(os.path.join(self.output, 'kind.txt'))
+        self.write('settings.py', 'PROGRAM = [prompt(), copy()]\n'
+                   'QUESTIONS = [{"kind": "text", "name": "kind", '
+                   '"message": "Kind", "default": "lib"}]\n')
+        self.watcher.poll()
+        assert 'lib' == self.read('kind.txt')